@@ -0,0 +1,129 @@
+"""
+Memoized computation graph for the Deep Dive page.
+
+Every derived frame is a cached node keyed by the inputs it depends on: the presentation id,
+and for the segment nodes the selected slide id and the pushdown flag. A rerun triggered by an
+unrelated widget is served from the node caches, and picking another slide only recomputes the
+segment nodes of that slide.
+"""
+
+import streamlit as st
+
+from warehouse_repo import (
+    PointsCube,
+    SegmentIndex,
+    aggregate_segment_stats,
+    aggregate_slide_stats,
+    decode_answers,
+    get_answer_distribution,
+    get_audience_segments,
+    get_interactions_of_presentation,
+    get_points_of_presentation,
+    get_slide_dimension,
+    get_slide_option_table,
+    get_slide_segment_stats,
+    iter_interactions_of_presentation,
+)
+
+ALL_SLIDES = {'Slideid': 'All', 'Slidetitle': 'All', 'Slidetypenormalized': ''}
+
+
+@st.cache_data(ttl='60m')
+def slides(presentation_id):
+    return get_slide_dimension(presentation_id)
+
+
+@st.cache_resource(ttl='60m', max_entries=32)
+def interactions(presentation_id):
+    """
+    Decoded interactions joined with the slide labels, and their SegmentIndex.
+    Shared by all sessions without copying, so nodes must not modify the frame.
+    """
+    df = get_interactions_of_presentation(presentation_id)
+    # Adds 'Chosen Pick Answer', 'Chosen Poll' and 'Chosen Short Answer'
+    df = decode_answers(df, get_slide_option_table(presentation_id))
+    df['Answer Text'] = df[['Chosen Pick Answer', 'Chosen Poll', 'Chosen Short Answer']].bfill(axis=1).iloc[:, 0]
+    slide_labels = slides(presentation_id)[['Slideid', '#', 'Slidetitle', '# Slidetitle']]
+    df = df.drop(columns=['Slidetitle']).merge(slide_labels, on='Slideid', how='left').sort_values(by='Slideorder')
+    return df, SegmentIndex(df)
+
+
+def selected_slide(presentation_id, slide_id):
+    if slide_id == 'All':
+        return ALL_SLIDES
+    all_slides_df = slides(presentation_id)
+    return all_slides_df[all_slides_df['Slideid'] == slide_id].iloc[0].to_dict()
+
+
+@st.cache_data(ttl='60m')
+def segment_stats(presentation_id, slide_id, pushdown=False):
+    """
+    Interaction counts and engagement per slide x segment.
+
+    Returns:
+        Dict with the 'interaction_count' and 'unique_audience' chart frames
+    """
+    slide = selected_slide(presentation_id, slide_id)
+    if pushdown:
+        stats = get_slide_segment_stats(presentation_id, slide)
+    else:
+        df, segment_index = interactions(presentation_id)
+        stats = aggregate_segment_stats(df, slide, segment_index)
+
+    slide_labels = slides(presentation_id)[['Slideid', 'Index', '#', 'Slidetitle', '# Slidetitle']]
+    slide_segment_df = stats['slides'].drop(columns=['Slidetitle']).merge(slide_labels, on='Slideid', how='left')
+    slide_segment_df = slide_segment_df.sort_values(by='Slideorder')
+
+    interaction_count_data = slide_segment_df[['Slideid', 'Slidetitle', '# Slidetitle', 'Slideorder', 'Segment', 'Slidetypenormalized', 'Interaction Count']]
+
+    unique_audience_data = slide_segment_df.drop(columns=['Interaction Count', 'Index'])
+    unique_audience_data['Engagement Rate'] = unique_audience_data['Audience Count'] / unique_audience_data['Segment Audience Count']
+    unique_audience_data['Percent of engaged audience'] = unique_audience_data['Audience Count'] / stats['total_audience'] * 100
+
+    return {'interaction_count': interaction_count_data, 'unique_audience': unique_audience_data}
+
+
+@st.cache_data(ttl='60m')
+def slide_activity(presentation_id, pushdown=False):
+    """
+    Interaction and unique audience counts per slide. With pushdown the raw interactions are
+    never loaded whole, so they are streamed from Redshift and folded batch by batch.
+    """
+    if pushdown:
+        batches = iter_interactions_of_presentation(presentation_id)
+    else:
+        batches = [interactions(presentation_id)[0]]
+    activity = aggregate_slide_stats(batches)
+    slide_labels = slides(presentation_id)[['Slideid', '#']]
+    return activity.merge(slide_labels, on='Slideid', how='left')
+
+
+@st.cache_resource(ttl='60m', max_entries=32)
+def points_cube(presentation_id):
+    return PointsCube(get_points_of_presentation(presentation_id))
+
+
+@st.cache_data(ttl='60m')
+def points_per_slide(presentation_id, slide_id, pushdown=False):
+    """
+    Average earned and bonus points per slide x segment, reduced from the points cube.
+    """
+    if slide_id == 'All':
+        audience_segments = None
+    elif pushdown:
+        audience_segments = get_audience_segments(presentation_id, selected_slide(presentation_id, slide_id))
+    else:
+        _, segment_index = interactions(presentation_id)
+        audience_segments = segment_index.audience_segment(slide_id)
+
+    points_df = points_cube(presentation_id).mean_by_segment(audience_segments)
+    slide_labels = slides(presentation_id)[['Slideid', 'Index', 'Slidetitle', '# Slidetitle', 'Slidetypenormalized']]
+    points_df = points_df.merge(slide_labels, on='Slideid', how='inner')
+    return points_df.sort_values(by='Index').reset_index(drop=True)
+
+
+@st.cache_data(ttl='60m')
+def answer_distribution(presentation_id, slide_id):
+    df, _ = interactions(presentation_id)
+    distribution = get_answer_distribution(df, get_slide_option_table(presentation_id))
+    return distribution[distribution['Slideid'] == slide_id]
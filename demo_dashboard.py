@@ -3,6 +3,7 @@ import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import warnings
+from interaction_export import load_export
 warnings.filterwarnings('ignore')
 
 # Page configuration
@@ -12,16 +13,14 @@ st.set_page_config(
     layout="wide"
 )
 
+# Every column the demo reads, the rest of the export is never loaded
+DEMO_COLUMNS = ['Createdat', 'Interaction Source', 'Slidetypenormalized', 'Slidetitle',
+                'Audience Name', 'Team Name', 'Presentation Name', 'Audienceid', 'Slideid']
+
 def load_sample_data():
     """Load the sample presentation data"""
     try:
-        df = pd.read_csv('sample_presentation_data.csv', low_memory=False)
-
-        # Convert date columns to datetime
-        if 'Createdat' in df.columns:
-            df['Createdat'] = pd.to_datetime(df['Createdat'], format='%d-%m-%Y, %H:%M', errors='coerce')
-
-        return df
+        return load_export('sample_presentation_data.csv', columns=DEMO_COLUMNS)
     except Exception as e:
         st.error(f"Error loading sample data: {e}")
         return None
@@ -7,6 +7,7 @@ import numpy as np
 from datetime import datetime, timedelta
 import json
 import warnings
+from interaction_export import FilterIndex, TimeRollup, fillna_category, load_export
 warnings.filterwarnings('ignore')
 
 # Page configuration
@@ -43,28 +44,25 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Every column the page reads, the rest of the export is never loaded
+EVENT_COLUMNS = ['Createdat', 'Interaction Source', 'Slidetypenormalized', 'Slidetitle',
+                 'Presentation Name', 'Team Name', 'Audience Name', 'Reactiontype',
+                 'Slideoptions', 'Audienceid', 'Slideid']
+
 @st.cache_data
 def load_data(file_path):
     """Load and preprocess the interaction data"""
     try:
-        df = pd.read_csv(file_path, low_memory=False)
-
-        # Convert date columns to datetime
-        date_columns = ['Createdat', 'Updatedat', 'Answeredtimestamp',
-                       'Audience Created At', 'Audience Updated At',
-                       'Slide Created At', 'Slide Updated At']
-
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], format='%d-%m-%Y, %H:%M', errors='coerce')
+        # Parsed and typed once per export, later loads read the columns from its snapshot
+        df = load_export(file_path, columns=EVENT_COLUMNS)
 
         # Clean up interaction source
         if 'Interaction Source' in df.columns:
-            df['Interaction Source'] = df['Interaction Source'].fillna('unknown')
+            df['Interaction Source'] = fillna_category(df['Interaction Source'], 'unknown')
 
         # Clean up slide type
         if 'Slidetypenormalized' in df.columns:
-            df['Slidetypenormalized'] = df['Slidetypenormalized'].fillna('unknown')
+            df['Slidetypenormalized'] = fillna_category(df['Slidetypenormalized'], 'unknown')
 
         return df
     except Exception as e:
@@ -116,51 +114,63 @@ def get_event_properties(df):
 
     return properties
 
-def filter_data(df, filters):
-    """Apply filters to the dataset"""
-    filtered_df = df.copy()
-
-    for filter_name, filter_value in filters.items():
-        if filter_value and filter_value != 'All':
-            if filter_name == 'Event Type':
-                filtered_df = filtered_df[filtered_df['Interaction Source'] == filter_value]
-            elif filter_name == 'Slide Type':
-                filtered_df = filtered_df[filtered_df['Slidetypenormalized'] == filter_value]
-            elif filter_name == 'Presentation':
-                filtered_df = filtered_df[filtered_df['Presentation Name'] == filter_value]
-            elif filter_name == 'Team':
-                filtered_df = filtered_df[filtered_df['Team Name'] == filter_value]
-            elif filter_name == 'Reaction Type':
-                filtered_df = filtered_df[filtered_df['Reactiontype'] == filter_value]
-
-    return filtered_df
-
-def create_time_series_data(df, time_column='Createdat', time_granularity='1H'):
+# Sidebar filter -> column it matches
+EVENT_FILTER_COLUMNS = {
+    'Event Type': 'Interaction Source',
+    'Slide Type': 'Slidetypenormalized',
+    'Presentation': 'Presentation Name',
+    'Team': 'Team Name',
+    'Reaction Type': 'Reactiontype',
+}
+
+@st.cache_resource
+def load_filter_index(file_path):
+    """Inverted filter index of a dataset, built once per file. None when the file failed to load"""
+    df = load_data(file_path)
+    if df is None:
+        return None
+    return FilterIndex(df, EVENT_FILTER_COLUMNS)
+
+def filter_data(df, filters, filter_index=None, columns=None):
+    """Apply filters to the dataset, keeping only `columns` when given"""
+    if filter_index is None:
+        filter_index = FilterIndex(df, EVENT_FILTER_COLUMNS)
+    # Intersects the row positions of the selected values, only matching rows (and columns) are copied
+    return filter_index.filter(filters, columns=columns)
+
+# Columns summed into the distinct properties series
+DISTINCT_PROPERTY_COLUMNS = ['Interaction Source', 'Slidetypenormalized', 'Audienceid', 'Slideid']
+# Columns of the filtered rows the metrics and the time series read
+METRIC_COLUMNS = ['Createdat', 'Audienceid', 'Slideid', 'Interaction Source']
+# Columns of the filtered data preview
+PREVIEW_COLUMNS = ['Createdat', 'Interaction Source', 'Slidetypenormalized',
+                   'Slidetitle', 'Audience Name', 'Team Name', 'Presentation Name']
+# Rows of the filtered data preview
+PREVIEW_ROWS = 100
+
+@st.cache_resource(max_entries=64)
+def load_time_rollup(file_path, filters, time_column='Createdat'):
+    """5 minute rollup of a filter combination, every granularity is merged from it"""
+    filter_index = load_filter_index(file_path)
+    filtered_df = filter_index.filter(filters, columns=[time_column] + DISTINCT_PROPERTY_COLUMNS)
+    return TimeRollup(filtered_df, time_column, DISTINCT_PROPERTY_COLUMNS)
+
+def create_time_series_data(df, time_column='Createdat', time_granularity='1H', rollup=None):
     """Create time series data for events and distinct properties"""
     if time_column not in df.columns:
         st.error(f"Time column '{time_column}' not found in data")
         return None, None
 
-    # Remove rows with missing timestamps
-    df_clean = df.dropna(subset=[time_column])
+    if rollup is None:
+        rollup = TimeRollup(df, time_column, [col for col in DISTINCT_PROPERTY_COLUMNS if col in df.columns])
 
-    if df_clean.empty:
+    if rollup.empty:
         st.error("No valid timestamps found in data")
         return None, None
 
-    # Set time column as index and resample
-    df_clean = df_clean.set_index(time_column).sort_index()
-
-    # Event count over time
-    event_counts = df_clean.resample(time_granularity).size()
-
-    # Distinct properties count over time
-    distinct_properties = df_clean.resample(time_granularity).agg({
-        'Interaction Source': 'nunique',
-        'Slidetypenormalized': 'nunique',
-        'Audienceid': 'nunique',
-        'Slideid': 'nunique'
-    }).sum(axis=1)
+    # Merged from the fine buckets of the rollup, same bins as resample()
+    event_counts, distinct_counts = rollup.resample(time_granularity)
+    distinct_properties = distinct_counts.sum(axis=1)
 
     return event_counts, distinct_properties
 
@@ -237,13 +247,16 @@ def main():
         index=0
     )
 
-    # Load data
-    df = load_data(file_options[selected_file])
+    # Load data. The index keeps its own reference to the dataset, share it instead of
+    # unpickling another copy from the data cache on every rerun
+    filter_index = load_filter_index(file_options[selected_file])
 
-    if df is None:
+    if filter_index is None:
         st.error("Failed to load data. Please check your file.")
         return
 
+    df = filter_index.df
+
     # Display data info
     st.sidebar.markdown("---")
     st.sidebar.markdown("**Dataset Info:**")
@@ -279,7 +292,7 @@ def main():
     )
 
     # Apply filters
-    filtered_df = filter_data(df, filters)
+    filtered_df = filter_data(df, filters, filter_index, columns=METRIC_COLUMNS)
 
     # Main content area
     col1, col2, col3, col4 = st.columns(4)
@@ -310,7 +323,8 @@ def main():
     event_counts, distinct_properties = create_time_series_data(
         filtered_df,
         time_column='Createdat',
-        time_granularity=time_granularity
+        time_granularity=time_granularity,
+        rollup=load_time_rollup(file_options[selected_file], filters)
     )
 
     # Create and display charts
@@ -341,15 +355,12 @@ def main():
     st.markdown("---")
     st.subheader("📋 Filtered Data Preview")
 
-    # Show relevant columns
-    display_columns = ['Createdat', 'Interaction Source', 'Slidetypenormalized',
-                      'Slidetitle', 'Audience Name', 'Team Name', 'Presentation Name']
-
-    available_columns = [col for col in display_columns if col in filtered_df.columns]
+    # Show relevant columns, only for the rows that are displayed
+    available_columns = [col for col in PREVIEW_COLUMNS if col in df.columns]
 
     if available_columns:
         st.dataframe(
-            filtered_df[available_columns].head(100),
+            df.loc[filtered_df.index[:PREVIEW_ROWS], available_columns],
             use_container_width=True
         )
     else:
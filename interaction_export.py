@@ -0,0 +1,271 @@
+"""
+Typed Feather snapshots of the interaction CSV exports, read with column projection.
+
+The first load of an export parses the CSV and its date columns once and stores the typed
+result as an uncompressed Feather (Arrow IPC) file next to the query result cache. Later loads,
+from any Streamlit process, read that file through a memory map instead of parsing the CSV again.
+The returned DataFrame is an ordinary copy of the selected columns, the map only avoids reading
+the other columns. Snapshots are keyed by the export's path, mtime and size, so a re-exported
+file gets a fresh snapshot.
+
+Pages pass the columns they use, and only those columns are read from the snapshot, so the
+heavy JSON columns (Slideoptions, Scalesconfiguration, ...) stay on disk unless asked for.
+FilterIndex serves the sidebar filters of a loaded export from an inverted index, and TimeRollup
+its time series at any granularity from one pass over the rows.
+"""
+
+import contextlib
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from result_cache import RESULT_CACHE_DIR
+
+SNAPSHOT_DIR = os.getenv("EXPORT_SNAPSHOT_DIR", os.path.join(RESULT_CACHE_DIR, "snapshots"))
+
+DATE_COLUMNS = ['Createdat', 'Updatedat', 'Answeredtimestamp',
+                'Audience Created At', 'Audience Updated At',
+                'Slide Created At', 'Slide Updated At']
+DATE_FORMAT = '%d-%m-%Y, %H:%M'
+
+# Declared up front instead of inferred by read_csv
+CATEGORY_COLUMNS = ['Interaction Source', 'Slidetypenormalized', 'Reactiontype']
+ID_COLUMNS = ['Presentationid', 'Slideid', 'Teamid', 'Userid']
+
+# Bump when the dtype plan changes, so existing snapshots are rebuilt
+SNAPSHOT_VERSION = 2
+
+# Finest bucket of a TimeRollup, coarser granularities must be multiples of it
+ROLLUP_BUCKET = '5min'
+# Bins x values above which merged sketches are deduplicated by sorting instead of a bitmap
+ROLLUP_BITMAP_MAX_BITS = 1 << 26
+
+
+def read_export(file_path):
+    """
+    Parse a CSV export with the dtype plan: categorical low cardinality strings, nullable integer
+    ids and datetime date columns.
+    """
+    df = pd.read_csv(file_path, dtype={col: 'category' for col in CATEGORY_COLUMNS}, low_memory=False)
+    for col in ID_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format=DATE_FORMAT, errors='coerce')
+    return df
+
+
+def fillna_category(series, value):
+    """
+    fillna for a possibly categorical Series, adding `value` to its categories when needed.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
+
+
+def _snapshot_prefix(file_path):
+    return hashlib.sha256(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16]
+
+
+def snapshot_path(file_path):
+    stat = os.stat(file_path)
+    return os.path.join(SNAPSHOT_DIR, f'{_snapshot_prefix(file_path)}-v{SNAPSHOT_VERSION}-{stat.st_mtime_ns}-{stat.st_size}.feather')
+
+
+def _to_arrow(df):
+    # Columns mixing numbers and strings (read_csv object columns) are stored as strings
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True).startswith('mixed'):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_snapshot(file_path, df):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = snapshot_path(file_path)
+    # Unique across the Streamlit processes and threads writing the same snapshot
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    # Uncompressed, so readers can memory-map the column buffers
+    feather.write_feather(_to_arrow(df), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+    # Older snapshots of the same export are never read again
+    prefix = _snapshot_prefix(file_path)
+    for name in os.listdir(SNAPSHOT_DIR):
+        if name.startswith(prefix) and name.endswith('.feather') and os.path.join(SNAPSHOT_DIR, name) != path:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(SNAPSHOT_DIR, name))
+
+
+def _project(df, columns):
+    return df if columns is None else df[[col for col in columns if col in df.columns]]
+
+
+def load_export(file_path, columns=None):
+    """
+    DataFrame of a CSV export, converted from its snapshot when there is one.
+
+    Args:
+        file_path: Path of the CSV export
+        columns: Columns the page uses; missing ones are ignored. Defaults to all columns.
+    """
+    path = snapshot_path(file_path)
+    try:
+        # Mapping is lazy, only the pages of the selected columns are read
+        table = feather.read_table(path, memory_map=True)
+        if columns is not None:
+            table = table.select([col for col in columns if col in table.column_names])
+        return table.to_pandas()
+    except FileNotFoundError:
+        pass
+    except Exception:
+        # Partially written or corrupt snapshot: rebuild it from the CSV. Another process may have
+        # removed it already
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+    df = read_export(file_path)
+    write_snapshot(file_path, df)
+    return _project(df, columns)
+
+
+class FilterIndex:
+    """
+    Inverted index of an export for equality filters: for every filter, value -> sorted row positions.
+    A combined filter intersects the position arrays of the selected values, smallest first, and
+    only the rows (and columns) asked for are materialized.
+    """
+
+    def __init__(self, df, filter_columns):
+        """
+        Args:
+            df: The export
+            filter_columns: Filter name -> column it matches, e.g. {'Slide Type': 'Slidetypenormalized'}
+        """
+        self.df = df
+        self._positions = {}
+        for name, col in filter_columns.items():
+            if col not in df.columns:
+                continue
+            codes, values = pd.factorize(df[col])
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+            self._positions[name] = {value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(values)}
+
+    def positions(self, filters):
+        """
+        Sorted row positions matching every selected filter, or None when nothing is selected.
+        Empty and 'All' values are not filters.
+        """
+        selected = [
+            self._positions[name].get(value, np.empty(0, dtype=np.intp))
+            for name, value in filters.items()
+            if value and value != 'All' and name in self._positions
+        ]
+        if not selected:
+            return None
+        selected.sort(key=len)
+        positions = selected[0]
+        for rows in selected[1:]:
+            positions = np.intersect1d(positions, rows, assume_unique=True)
+        return positions
+
+    def filter(self, filters, columns=None):
+        """
+        Rows of the export matching `filters`, with only `columns` when given.
+        """
+        df = self.df if columns is None else self.df[[col for col in columns if col in self.df.columns]]
+        positions = self.positions(filters)
+        return df if positions is None else df.take(positions)
+
+
+class TimeRollup:
+    """
+    Event counts and distinct-value sketches of an export per fine time bucket. The sketch of a
+    column is the exact set of its value codes seen in each bucket, stored as sorted
+    (bucket, code) pairs, so buckets merge into any coarser granularity by a set union instead of
+    a rescan of the rows. Bins line up with DataFrame.resample: they start at midnight of the
+    first day, and empty bins in between are zero.
+    """
+
+    def __init__(self, df, time_column='Createdat', distinct_columns=(), bucket=ROLLUP_BUCKET):
+        """
+        Args:
+            df: The (filtered) export
+            time_column: Datetime column to bucket on, rows without a timestamp are skipped
+            distinct_columns: Columns to keep a distinct-value sketch for; missing ones are ignored
+            bucket: Finest granularity, e.g. '5min'
+        """
+        self.time_column = time_column
+        self.bucket = pd.Timedelta(bucket)
+        times = df[time_column]
+        valid = times.notna().to_numpy()
+        self.empty = not valid.any()
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._sketches = {}
+        if self.empty:
+            return
+
+        times = times[valid]
+        self.origin = times.min().normalize()
+        buckets = ((times - self.origin) // self.bucket).to_numpy(dtype=np.int64)
+        self.first = int(buckets.min())
+        buckets = buckets - self.first
+        self.counts = np.bincount(buckets)
+
+        for col in distinct_columns:
+            if col not in df.columns:
+                continue
+            # NaN gets code -1 and, like nunique, is not counted
+            codes, values = pd.factorize(df[col][valid])
+            n_values = max(len(values), 1)
+            keep = codes >= 0
+            pairs = np.unique(buckets[keep] * n_values + codes[keep])
+            self._sketches[col] = (pairs // n_values, pairs % n_values, n_values)
+
+    def _factor(self, granularity):
+        freq = pd.Timedelta(granularity)
+        if freq % self.bucket:
+            raise ValueError(f'Granularity {granularity} is not a multiple of the {self.bucket} rollup bucket')
+        return freq, freq // self.bucket
+
+    def resample(self, granularity):
+        """
+        Event count and distinct counts per bin, merged from the fine buckets.
+
+        Returns:
+            (event_counts Series, DataFrame with a column per sketched column)
+        """
+        freq, factor = self._factor(granularity)
+        if self.empty:
+            index = pd.DatetimeIndex([], name=self.time_column)
+            return pd.Series(0, index=index, dtype=np.int64), pd.DataFrame(index=index, columns=list(self._sketches), dtype=np.int64)
+
+        # Fine bucket i covers origin + (first + i) * bucket
+        coarse = (np.arange(len(self.counts)) + self.first) // factor
+        coarse_first = int(coarse[0])
+        size = int(coarse[-1]) - coarse_first + 1
+        index = pd.DatetimeIndex(self.origin + freq * np.arange(coarse_first, coarse_first + size), name=self.time_column)
+        event_counts = pd.Series(np.bincount(coarse - coarse_first, weights=self.counts, minlength=size).astype(np.int64), index=index)
+
+        distinct = {}
+        for col, (buckets, codes, n_values) in self._sketches.items():
+            keys = (coarse[buckets] - coarse_first) * n_values + codes
+            # Union of the bucket sets: a value seen in several buckets of a bin counts once
+            if factor == 1:
+                merged = keys
+            elif size * n_values <= ROLLUP_BITMAP_MAX_BITS:
+                bitmap = np.zeros(size * n_values, dtype=bool)
+                bitmap[keys] = True
+                merged = np.flatnonzero(bitmap)
+            else:
+                merged = np.unique(keys)
+            distinct[col] = np.bincount(merged // n_values, minlength=size).astype(np.int64)
+        return event_counts, pd.DataFrame(distinct, index=index)
@@ -0,0 +1,102 @@
+"""
+Named SQL queries with bound parameters.
+
+The SQL text of a registered query never changes between tenants, so Redshift can reuse
+the compiled plan and the result cache is keyed by (query name, params) instead of a
+different SQL string per user/presentation.
+"""
+
+import hashlib
+import re
+
+from sqlalchemy import bindparam, text
+
+QUERIES = {}
+_SOURCES = {}
+
+
+def _compile(sql: str, expanding=()):
+    stmt = text(sql)
+    if expanding:
+        stmt = stmt.bindparams(*[bindparam(param, expanding=True) for param in expanding])
+    return stmt
+
+
+def register_query(name: str, sql: str, expanding=()):
+    """
+    Register a query under `name`. Parameters use the `:param` placeholder style.
+
+    Args:
+        name: Unique query name, also the first part of the cache key
+        sql: SQL text with `:param` placeholders
+        expanding: Names of list parameters, used as `IN :param` (the expanded list brings its own parentheses)
+
+    Returns:
+        The query name, so modules can keep it in a constant
+    """
+    QUERIES[name] = _compile(sql, expanding)
+    _SOURCES[name] = (sql, tuple(expanding))
+    return name
+
+
+# Redshift documents a relative error of about 2% for APPROXIMATE COUNT(DISTINCT ...)
+APPROXIMATE_COUNT_DISTINCT_ERROR = 0.02
+
+
+def approximate_name(name: str):
+    return f'{name}_approximate'
+
+
+def register_approximate_query(name: str):
+    """
+    Register the approximate variant of a registered query, with every COUNT(DISTINCT ...)
+    replaced by Redshift's HyperLogLog based APPROXIMATE COUNT(DISTINCT ...).
+
+    Returns:
+        The name of the approximate variant
+    """
+    get_query(name)
+    sql, expanding = _SOURCES[name]
+    return register_query(approximate_name(name), re.sub(r'(?<!APPROXIMATE )COUNT\(DISTINCT', 'APPROXIMATE COUNT(DISTINCT', sql), expanding)
+
+
+def get_query(name: str):
+    try:
+        return QUERIES[name]
+    except KeyError:
+        raise KeyError(f'Unknown query: {name}') from None
+
+
+def get_cursor_query(name: str, cursor_name: str):
+    """
+    `DECLARE <cursor_name> CURSOR FOR <query>` for a registered query, with the same bound parameters.
+    Used to stream large results from a server side cursor.
+    """
+    get_query(name)
+    sql, expanding = _SOURCES[name]
+    return _compile(f'DECLARE {cursor_name} CURSOR FOR {sql.strip().rstrip(";")}', expanding)
+
+
+def query_fingerprint(name: str):
+    """
+    Short hash of a registered query's SQL, so persisted results are not reused after the SQL changes.
+    """
+    get_query(name)
+    return hashlib.sha256(repr(_SOURCES[name]).encode('utf-8')).hexdigest()[:16]
+
+
+def _normalize_param(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = sorted(value) if isinstance(value, (set, frozenset)) else value
+        return tuple(_normalize_param(item) for item in items)
+    if hasattr(value, 'item'):  # numpy scalars
+        return value.item()
+    return value
+
+
+def query_key(name: str, params: dict = None):
+    """
+    Normalized, hashable cache key for a named query: (name, ((param, value), ...)).
+    """
+    params = params or {}
+    return name, tuple(sorted((key, _normalize_param(value)) for key, value in params.items()))
@@ -2,12 +2,22 @@
 Redshift engine compatible with streamlit cache
 """
 
+import decimal
+import threading
+import time
+from contextlib import contextmanager
+
 import streamlit as st
+import pandas as pd
+import pyarrow as pa
 from dotenv import load_dotenv
 import sqlalchemy as sa
-from sqlalchemy import text
+from sqlalchemy import event, text
 from sqlalchemy.engine.url import URL
 
+import result_cache
+from query_registry import get_cursor_query, get_query, query_fingerprint, query_key
+
 load_dotenv('.env.local')
 import os
 
@@ -16,7 +26,36 @@ REDSHIFT_USER = os.getenv("REDSHIFT_USER")
 REDSHIFT_PASSWORD = os.getenv("REDSHIFT_PASSWORD")
 REDSHIFT_HOST = os.getenv("REDSHIFT_HOST")
 
-@st.cache_resource(ttl='60m')
+# Rows decoded per fetchmany call; only this many row tuples are alive at once
+FETCH_CHUNK_SIZE = int(os.getenv("REDSHIFT_FETCH_CHUNK_SIZE", 50_000))
+
+# Connection pool, shared by every dashboard session in the process
+REDSHIFT_POOL_SIZE = int(os.getenv("REDSHIFT_POOL_SIZE", 5))
+REDSHIFT_MAX_OVERFLOW = int(os.getenv("REDSHIFT_MAX_OVERFLOW", 10))
+REDSHIFT_POOL_TIMEOUT = int(os.getenv("REDSHIFT_POOL_TIMEOUT", 30))
+# Recycle well before Redshift / NAT idle timeouts silently drop the socket
+REDSHIFT_POOL_RECYCLE = int(os.getenv("REDSHIFT_POOL_RECYCLE", 30 * 60))
+REDSHIFT_KEEPALIVE_IDLE = int(os.getenv("REDSHIFT_KEEPALIVE_IDLE", 60))
+
+_stats_lock = threading.Lock()
+_stats = {
+    'connects': 0,
+    'connect_seconds_total': 0.0,
+    'connect_seconds_max': 0.0,
+    'checkouts': 0,
+    'checkout_wait_seconds_total': 0.0,
+    'checkout_wait_seconds_max': 0.0,
+}
+
+
+def _record(counter, metric, seconds):
+    with _stats_lock:
+        _stats[counter] += 1
+        _stats[f'{metric}_seconds_total'] += seconds
+        _stats[f'{metric}_seconds_max'] = max(_stats[f'{metric}_seconds_max'], seconds)
+
+
+@st.cache_resource
 def create_engine():
     # build the sqlalchemy URL
     url = URL.create(
@@ -28,21 +67,209 @@ def create_engine():
         username=REDSHIFT_USER, # Amazon Redshift username
         password=REDSHIFT_PASSWORD # Amazon Redshift password
     )
-    engine = sa.create_engine(url)
+    engine = sa.create_engine(
+        url,
+        pool_size=REDSHIFT_POOL_SIZE,
+        max_overflow=REDSHIFT_MAX_OVERFLOW,
+        pool_timeout=REDSHIFT_POOL_TIMEOUT,
+        pool_recycle=REDSHIFT_POOL_RECYCLE,
+        pool_pre_ping=True, # replaces the probe query, dead connections are replaced on checkout
+        connect_args={
+            'tcp_keepalive': True,
+            'tcp_keepalive_idle': REDSHIFT_KEEPALIVE_IDLE,
+            'tcp_keepalive_interval': 30,
+            'tcp_keepalive_count': 4,
+        },
+    )
 
-    sql = """
-    SELECT id FROM aha_report_x.mart_presentation_interactions LIMIT 1;
-    """
+    @event.listens_for(engine, 'do_connect')
+    def _timed_connect(dialect, conn_rec, cargs, cparams):
+        start = time.perf_counter()
+        dbapi_conn = dialect.connect(*cargs, **cparams)
+        _record('connects', 'connect', time.perf_counter() - start)
+        return dbapi_conn
 
-    with engine.connect() as conn:
-        conn.execute(text(sql))
     return engine
 
 
-@st.cache_data(ttl='60m')
-def execute(sql):
+@contextmanager
+def connect():
+    """
+    Check out a pooled connection, recording how long the checkout (including pre-ping) took.
+    """
     engine = create_engine()
-    with engine.connect() as conn:
-        res = conn.execute(text(sql))
-        rows = res.fetchall()
-    return rows
\ No newline at end of file
+    start = time.perf_counter()
+    conn = engine.connect()
+    _record('checkouts', 'checkout_wait', time.perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def pool_stats():
+    """
+    Current pool state plus cumulative connect / checkout latency since process start.
+    """
+    pool = create_engine().pool
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update({
+        'pool_size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': pool.overflow(),
+    })
+    stats['connect_seconds_avg'] = stats['connect_seconds_total'] / stats['connects'] if stats['connects'] else 0.0
+    stats['checkout_wait_seconds_avg'] = stats['checkout_wait_seconds_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+    return stats
+
+
+def _to_arrow_chunk(rows, names):
+    # pandas transposes the row tuples in C; typed columns then hand over to Arrow without a copy
+    df = pd.DataFrame.from_records(rows, columns=names)
+    for col in df.columns[df.dtypes == object]:
+        values = df[col].dropna()
+        if len(values) and isinstance(values.iloc[0], decimal.Decimal):
+            # NUMERIC aggregates come back as Decimal; keep them as float64 buffers
+            df[col] = df[col].astype(float)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _fetch_arrow(res, columns=None, chunk_size=FETCH_CHUNK_SIZE):
+    names = list(columns) if columns else list(res.keys())
+    tables = []
+    while True:
+        rows = res.fetchmany(chunk_size)
+        if not rows:
+            break
+        tables.append(_to_arrow_chunk(rows, names))
+    if not tables:
+        return pa.table({name: pa.array([], type=pa.null()) for name in names})
+    # A chunk with only NULLs in a column decodes as the null type, so let later chunks widen it
+    return pa.concat_tables(tables, promote_options='permissive')
+
+
+def execute_arrow(name, params=None, columns=None, cache=True):
+    """
+    Run a registered query and decode the result chunk by chunk into an Arrow table,
+    without materializing the full list of row tuples. The driver still returns Python row
+    tuples, so decoding costs about as much as pd.DataFrame(rows); what this buys is a peak
+    of one chunk of tuples and a table the Parquet result cache can store as is.
+
+    Args:
+        name: Registered query name
+        params: Bound parameters for the query
+        columns: Optional column names, defaults to the names returned by the driver
+        cache: Set to False to always read fresh rows, for callers that keep their own cache
+    """
+    name, params = query_key(name, params)
+    columns = tuple(columns) if columns else None
+    if not cache:
+        return _query_arrow(name, params, columns)
+    return _execute_arrow(name, params, columns)
+
+
+def _query_arrow(name, params, columns):
+    with connect() as conn:
+        res = conn.execute(get_query(name), dict(params))
+        return _fetch_arrow(res, columns)
+
+
+@st.cache_data(ttl='60m')
+def _execute_arrow(name, params, columns):
+    # In-memory tier misses (e.g. after a restart) fall back to the on-disk Parquet tier
+    return result_cache.get_or_fetch(
+        (name, query_fingerprint(name), params, columns),
+        lambda: _query_arrow(name, params, columns)
+    )
+
+
+def execute_frame(name, params=None, columns=None, cache=True):
+    """
+    Same as execute_arrow but returns a DataFrame backed by NumPy column buffers.
+    """
+    return execute_arrow(name, params, columns, cache).to_pandas()
+
+
+# Rows per multi-row INSERT when staging data into a temp table
+STAGE_INSERT_BATCH_SIZE = 1000
+
+
+def _insert_rows(conn, table, rows):
+    for start in range(0, len(rows), STAGE_INSERT_BATCH_SIZE):
+        chunk = rows[start:start + STAGE_INSERT_BATCH_SIZE]
+        values = ', '.join(
+            '(' + ', '.join(f':v{i}_{j}' for j in range(len(row))) + ')' for i, row in enumerate(chunk)
+        )
+        params = {f'v{i}_{j}': value for i, row in enumerate(chunk) for j, value in enumerate(row)}
+        conn.execute(text(f'INSERT INTO {table} VALUES {values}'), params)
+
+
+def _query_staged_arrow(name, params, columns, staged_tables):
+    with connect() as conn:
+        try:
+            with conn.begin():
+                for table, column_defs, rows in staged_tables:
+                    conn.execute(text(f'CREATE TEMP TABLE {table} ({column_defs})'))
+                    _insert_rows(conn, table, rows)
+                res = conn.execute(get_query(name), dict(params))
+                return _fetch_arrow(res, columns)
+        finally:
+            # Temp tables live as long as the session, drop them before the connection goes back to the pool
+            with conn.begin():
+                for table, _, _ in staged_tables:
+                    conn.execute(text(f'DROP TABLE IF EXISTS {table}'))
+
+
+@st.cache_data(ttl='60m')
+def _execute_staged_arrow(name, params, columns, staged_tables):
+    return result_cache.get_or_fetch(
+        (name, query_fingerprint(name), params, columns, staged_tables),
+        lambda: _query_staged_arrow(name, params, columns, staged_tables)
+    )
+
+
+def execute_staged_frame(name, params=None, columns=None, staged_tables=None):
+    """
+    Run a registered query that joins against session temp tables staged just before it.
+
+    Args:
+        name: Registered query name
+        params: Bound parameters for the query
+        columns: Optional column names
+        staged_tables: Mapping of temp table name -> (column definitions, rows)
+
+    Returns:
+        DataFrame, cached on the query key plus the staged rows
+    """
+    name, params = query_key(name, params)
+    staged = tuple(sorted(
+        (table, column_defs, tuple(tuple(row) for row in rows))
+        for table, (column_defs, rows) in (staged_tables or {}).items()
+    ))
+    return _execute_staged_arrow(name, params, tuple(columns) if columns else None, staged).to_pandas()
+
+
+def iter_frames(name, params=None, columns=None, chunk_size=FETCH_CHUNK_SIZE):
+    """
+    Stream a registered query as DataFrame batches of at most `chunk_size` rows.
+
+    The query runs behind a server side cursor, because redshift_connector otherwise buffers
+    the whole result client side before the first fetch. Only one batch is held at a time,
+    so memory stays bounded however large the result is. Results are not cached.
+    """
+    name, params = query_key(name, params)
+    with connect() as conn, conn.begin():
+        res = conn.execute(get_cursor_query(name, 'stream_cursor'), dict(params))
+        res.close()
+        while True:
+            res = conn.execute(text(f'FETCH FORWARD {int(chunk_size)} FROM stream_cursor'))
+            names = list(columns) if columns else list(res.keys())
+            rows = res.fetchall()
+            if not rows:
+                break
+            batch = _to_arrow_chunk(rows, names)
+            del rows
+            yield batch.to_pandas()
+        conn.execute(text('CLOSE stream_cursor'))
@@ -0,0 +1,133 @@
+"""
+Second-tier, on-disk result cache for redshift_api.
+
+Query results are stored as Parquet files keyed by the normalized (query name, SQL fingerprint, params) key,
+so they survive Streamlit restarts and deploys. The directory is kept under a byte budget
+with LRU eviction, and stale entries are served immediately while being refreshed in the
+background (stale-while-revalidate).
+"""
+
+import contextlib
+import hashlib
+import os
+import threading
+import time
+
+import pyarrow.parquet as pq
+
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", ".result_cache")
+# Set to 0 to disable the disk cache
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+# Entries older than this are still served, but trigger a background refresh
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", 60 * 60))
+
+_lock = threading.Lock()
+_refreshing = set()
+
+
+def is_enabled():
+    return RESULT_CACHE_MAX_BYTES > 0
+
+
+def _path(key):
+    digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(RESULT_CACHE_DIR, f'{digest}.parquet')
+
+
+def read(key):
+    """
+    Returns (table, is_stale) for a cached key, or None on a miss.
+    """
+    path = _path(key)
+    try:
+        stat = os.stat(path)
+        table = pq.read_table(path, memory_map=True)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # Partially written or corrupt file: drop it and treat as a miss
+        _remove(path)
+        return None
+    # atime is the LRU clock; mtime stays the write time used for staleness
+    with contextlib.suppress(FileNotFoundError):  # evicted by another process meanwhile
+        os.utime(path, (time.time(), stat.st_mtime))
+    return table, time.time() - stat.st_mtime > RESULT_CACHE_TTL_SECONDS
+
+
+def write(key, table):
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    path = _path(key)
+    # Unique across the Streamlit processes and threads sharing the cache directory
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    evict()
+
+
+def _remove(path):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def evict(max_bytes=None):
+    """
+    Delete least recently read entries until the cache fits in `max_bytes`.
+    """
+    max_bytes = RESULT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    with _lock:
+        entries = []
+        with os.scandir(RESULT_CACHE_DIR) as it:
+            for entry in it:
+                if entry.name.endswith('.parquet'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        # Evicted by another process sharing the directory
+                        continue
+                    entries.append((stat.st_atime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+
+def refresh_in_background(key, fetch):
+    """
+    Re-run `fetch` in a daemon thread and store its result, at most one refresh per key.
+    """
+    with _lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run():
+        try:
+            write(key, fetch())
+        except Exception:
+            # Keep serving the stale copy; the next read will try again
+            pass
+        finally:
+            with _lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_or_fetch(key, fetch):
+    """
+    Serve `key` from disk if present (refreshing stale entries in the background),
+    otherwise call `fetch` and store its Arrow table.
+    """
+    if not is_enabled():
+        return fetch()
+    cached = read(key)
+    if cached is not None:
+        table, is_stale = cached
+        if is_stale:
+            refresh_in_background(key, fetch)
+        return table
+    table = fetch()
+    write(key, table)
+    return table
@@ -5,11 +5,11 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import altair as alt
+from interaction_export import load_export
 
-df = pd.read_csv('duke_presentation_interactions.csv')
 # df.groupby('Presentationid').size().sort_values(ascending=False)
 # df = df[df['Presentationid'].isin([7021758, 6925119])].sort_values(by='Slideorder').copy()
-df = df[['Presentationid', 'Presentation Name', 'Slideid', 'Slidetitle', 'Slidetypenormalized', 'Slideoptions', 'Slideorder', 'Audience Name', 'Audienceid', 'Vote', 'Poll Vote', 'Title']]
+df = load_export('duke_presentation_interactions.csv', columns=['Presentationid', 'Presentation Name', 'Slideid', 'Slidetitle', 'Slidetypenormalized', 'Slideoptions', 'Slideorder', 'Audience Name', 'Audienceid', 'Vote', 'Poll Vote', 'Title'])
 df = df.sort_values(by='Slideorder').copy()
 
 
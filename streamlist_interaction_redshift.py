@@ -8,9 +8,13 @@ import pandas as pd
 import numpy as np
 import altair as alt
 
-from warehouse_repo import enrich_audience_with_category, enrich_points_with_audience_segment, extract_poll_value, extract_quiz_value, extract_short_answer, get_avg_point_per_question, get_participant_correct_stats, get_participant_count_per_day, get_participant_stats, get_points_of_presentation, get_wrong_often_questions
 from warehouse_repo import get_participant_count_per_week_v2
-from warehouse_repo import get_interactions_of_presentation, get_presentations_of_user
+from warehouse_repo import get_presentations_of_user
+from warehouse_repo import fetch_batch
+from warehouse_repo import get_participant_summary, get_question_summary
+from redshift_api import pool_stats
+from query_registry import APPROXIMATE_COUNT_DISTINCT_ERROR
+import deep_dive
 
 
 
@@ -24,11 +28,30 @@ with presentation_tab:
 # KIOTVIET_USER_ID = 259137
 params = st.query_params
 user_id = params.get('user_id', 1918789)
-presentation_df = get_presentations_of_user(user_id)
+
+
+def flag_param(name):
+    # Only explicit truthy values switch a mode on, so ?flag=0 or ?flag=false leave it off
+    return params.get(name, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+# ?approx=1 counts unique participants with APPROXIMATE COUNT(DISTINCT), for large tenants
+approximate = flag_param('approx')
+# None of the user level queries depend on each other, run them concurrently
+user_frames = fetch_batch({
+    'presentations': (get_presentations_of_user, {'user_id': user_id}),
+    'question_summary': (get_question_summary, {'user_id': user_id}),
+    'participant_summary': (get_participant_summary, {'user_id': user_id}),
+    'participant_count_per_week': (get_participant_count_per_week_v2, {'user_id': user_id, 'weeks': 8, 'approximate': approximate}),
+})
+presentation_df = user_frames['presentations']
 presentation_df = presentation_df.sort_values(by='createdat', ascending=False)
 
 st.set_page_config(layout="wide")
 
+if params.get('debug'):
+    with st.sidebar.expander('Redshift connection pool'):
+        st.json(pool_stats())
+
 
 def show_df_using_ag_grid(df, page_size=10):
     gb = GridOptionsBuilder.from_dataframe(df)
@@ -46,29 +69,29 @@ def show_df_using_ag_grid(df, page_size=10):
     )
 with overview_tab:
     st.subheader('Commonly Wrong Questions In The Last 3 Months')
-    wrong_df = get_wrong_often_questions(user_id)
+    wrong_df = user_frames['question_summary']['wrong_often_questions']
     show_df_using_ag_grid(wrong_df)
 
-    avg_point_per_question_df = get_avg_point_per_question(user_id)
+    avg_point_per_question_df = user_frames['question_summary']['avg_point_per_question']
     avg_point_per_question_df['Avg Point'] = avg_point_per_question_df['Avg Point'].round(2)
     st.subheader('Low Score Questions In The Last 3 Months')
     show_df_using_ag_grid(avg_point_per_question_df)
 
 
 with participant_tab:
-    participant_stats_df = get_participant_stats(user_id)
+    participant_stats_df = user_frames['participant_summary']['participant_stats']
     participant_stats_df['Avg Point'] = participant_stats_df['Avg Point'].round(2)
     st.subheader('Participant With Lowest Score')
     show_df_using_ag_grid(participant_stats_df, page_size=20)
 
-    participant_correct_stats_df = get_participant_correct_stats(user_id)
+    participant_correct_stats_df = user_frames['participant_summary']['participant_correct_stats']
     st.subheader('Participant With Lowest Correct Percentage')
     show_df_using_ag_grid(participant_correct_stats_df[['Participant Name', 'Total Answers', 'Correct Percentage']], page_size=20)
 
 
 
 with bottom_container:
-    audience_count_per_day_df = get_participant_count_per_week_v2(user_id, weeks=8)
+    audience_count_per_day_df = user_frames['participant_count_per_week']
     audience_count_per_day_df['Previous 4 weeks'] = audience_count_per_day_df['unique_audience'].shift(4).fillna(0)
     audience_count_per_day_df.rename(columns={'unique_audience': 'Current'}, inplace=True)
     data = audience_count_per_day_df.melt(id_vars=['week_start'], var_name='type', value_name='value')
@@ -91,6 +114,8 @@ with bottom_container:
     }
 
     st.altair_chart(chart, use_container_width=True)
+    if approximate:
+        st.caption(f'Approximate participant counts, about ±{APPROXIMATE_COUNT_DISTINCT_ERROR:.0%} relative error.')
 
 
 col1, col2 = bottom_container.columns([3, 1])
@@ -114,36 +139,32 @@ def get_active_presentation_title():
 with col1:
     st.subheader(f'Prez Title: {get_active_presentation_title()}')
 
-df = get_interactions_of_presentation(presentation_id)
-
-t = df[['Slideorder', 'Slideid']].value_counts().reset_index().sort_values(by='Slideorder')
-t['#'] = range(1, len(t) + 1)
-df = df.merge(t[['#', 'Slideorder', 'Slideid']], on=['Slideorder', 'Slideid'], how='left').sort_values(by='Slideorder')
-df['# Slidetitle'] = df.apply(lambda x: f"#{x['#']} - {x['Slidetitle']}", axis=1)
+# ?pushdown=1 aggregates the Deep Dive charts in Redshift instead of pulling the raw interactions
+pushdown = flag_param('pushdown')
 
-df['Chosen Pick Answer'] = df.apply(lambda x: extract_quiz_value(x['Slidetitle'], x['Slideoptions'], x['Vote']), axis=1)
-df['Chosen Poll'] = df.apply(lambda x: extract_poll_value(x['Slidetitle'], x['Slideoptions'], x['poll_vote']), axis=1)
-poll_answers = df[df['Chosen Poll'].notna()]['Chosen Poll'].unique()
-poll_answers = ['All'] + list(poll_answers)
+# Derived frames are cached nodes, see deep_dive; the first load of a presentation fetches concurrently
+presentation_nodes = {'slides': (deep_dive.slides, {'presentation_id': presentation_id})}
+if not pushdown:
+    presentation_nodes['interactions'] = (deep_dive.interactions, {'presentation_id': presentation_id})
+presentation_frames = fetch_batch(presentation_nodes)
 
+# Slide numbering and labels, joined by Slideid wherever they are needed
+all_slides_df = presentation_frames['slides']
 
-if 'selected_poll_answers' not in st.session_state:
-    st.session_state.selected_poll_answers = 'All'
-if 'selected_slide_type' not in st.session_state:
-    st.session_state.selected_slide_type = 'All'
-if 'selected_short_answer' not in st.session_state:
-    st.session_state.selected_short_answer = 'All'
+if not pushdown:
+    df, _ = presentation_frames['interactions']
+    poll_answers = df[df['Chosen Poll'].notna()]['Chosen Poll'].unique()
+    poll_answers = ['All'] + list(poll_answers)
 
-df['Chosen Short Answer'] = df.apply(lambda x: extract_short_answer(x['Slidetitle'], x['Title']), axis=1)
-chosen_answers = df['Chosen Short Answer'].dropna().unique()
 
-df['Answer Text'] = df[['Chosen Pick Answer', 'Chosen Poll', 'Chosen Short Answer']].bfill(axis=1).iloc[:, 0]
+    if 'selected_poll_answers' not in st.session_state:
+        st.session_state.selected_poll_answers = 'All'
+    if 'selected_slide_type' not in st.session_state:
+        st.session_state.selected_slide_type = 'All'
+    if 'selected_short_answer' not in st.session_state:
+        st.session_state.selected_short_answer = 'All'
 
-df['Slidetitle'] = df['Slidetitle'].astype(str)
-df['Slidetitle'] = df.apply(lambda x: x['Slidetitle'] if x['Slidetitle'] != 'nan' else '(empty)', axis=1)
-
-all_slides_df = df.groupby(['Slideid', 'Slidetitle', 'Slidetypenormalized', 'Slideorder']).size().reset_index().sort_values(by='Slideorder')[['Slideid', 'Slidetitle', 'Slidetypenormalized']]
-all_slides_df['Index'] = range(1, len(all_slides_df) + 1)
+    chosen_answers = df['Chosen Short Answer'].dropna().unique()
 all_slide_titles = all_slides_df.to_dict('records')
 poll_slide_titles = all_slides_df[all_slides_df['Slidetypenormalized'].isin(['Poll', 'Open Ended'])][['Slideid', 'Slidetitle', 'Slidetypenormalized']].to_dict('records')
 quiz_slide_titles = all_slides_df[all_slides_df['Slidetypenormalized'] == 'Pick Answer'][['Slideid', 'Slidetitle', 'Slidetypenormalized']].to_dict('records')
@@ -224,28 +245,14 @@ def create_segment_line_chart(data, y_field='Interaction Count', title='Empty',
     return chart
 
 
-interaction_count_data = enrich_audience_with_category(selected_slide, df)
-interaction_count_data = interaction_count_data.groupby(['Slideid', 'Slidetitle', '# Slidetitle', 'Slideorder', 'Segment', 'Slidetypenormalized']).size().reset_index().rename(columns={0: 'Interaction Count'})
-interaction_count_data = interaction_count_data.sort_values(by='Slideorder')
+segment_frames = deep_dive.segment_stats(presentation_id, selected_slide['Slideid'], pushdown)
+interaction_count_data = segment_frames['interaction_count']
 
 with col1:
     chart1 = create_segment_line_chart(interaction_count_data, y_field='Interaction Count', title='Interaction count per slide')
     st.altair_chart(chart1, use_container_width=True)
 
-unique_audience_data = enrich_audience_with_category(selected_slide, df)
-presentation_audience_count = unique_audience_data['audienceid'].nunique()
-
-
-unique_audience_per_segment = unique_audience_data.groupby(['Segment'])['audienceid'].nunique().reset_index().rename(columns={'audienceid': 'Segment Audience Count'})
-
-unique_audience_data = unique_audience_data.groupby(['#', 'Slideid', 'Slidetitle', '# Slidetitle', 'Slideorder', 'Segment', 'Slidetypenormalized'])['audienceid'].nunique().reset_index().rename(columns={'audienceid': 'Audience Count'})
-unique_audience_data = unique_audience_data.sort_values(by='Slideorder')
-
-unique_audience_data = unique_audience_data.merge(unique_audience_per_segment, on='Segment', how='left')
-unique_audience_data['Engagement Rate'] = unique_audience_data['Audience Count'] / unique_audience_data['Segment Audience Count']
-
-unique_audience_data['Percent of engaged audience'] = unique_audience_data['Audience Count'] / presentation_audience_count * 100
-unique_audience_data = unique_audience_data.sort_values(by='Slideorder')
+unique_audience_data = segment_frames['unique_audience']
 y_field = 'Percent of engaged audience'
 
 chart2 = create_segment_line_chart(unique_audience_data, y_field='Engagement Rate', type='percent', title="Engagement rate (no. audience who have submissions/no. audiences in segment)")
@@ -253,14 +260,25 @@ chart2 = create_segment_line_chart(unique_audience_data, y_field='Engagement Rat
 with col1:
     st.altair_chart(chart2, use_container_width=True)
 
-points_df = get_points_of_presentation(presentation_id)
-points_df = points_df.rename(columns={'Earned_points': 'Earned points', 'Bonus_points': 'Bonus points'})
-points_df = enrich_points_with_audience_segment(selected_slide, df, points_df)
-points_df = points_df.dropna()
-points_df = pd.merge(points_df, all_slides_df, on=['Slideid'], how='left')
-points_df['# Slidetitle'] = points_df.apply(lambda x: f"#{x['Index']} - {x['Slidetitle']}", axis=1)
-points_df = points_df.groupby(['Segment', 'Slideid', 'Index', 'Slidetitle', '# Slidetitle', 'Slidetypenormalized']).agg({'Earned points': 'mean', 'Bonus points': 'mean'}).reset_index()
-points_df = points_df.sort_values(by='Index')
+points_df = deep_dive.points_per_slide(presentation_id, selected_slide['Slideid'], pushdown)
 chart3 = create_segment_line_chart(points_df, y_field='Earned points', title='Average earned points per slide')
 with col1:
     st.altair_chart(chart3, use_container_width=True)
+
+if not pushdown and selected_slide['Slidetypenormalized'] == 'Pick Answer':
+    # Every option of a multi-select vote is counted, not only the first one
+    answer_distribution = deep_dive.answer_distribution(presentation_id, selected_slide['Slideid'])
+    chart4 = alt.Chart(answer_distribution).mark_bar(size=12).encode(
+        x=alt.X('Option:N', title='Option', sort='-y', axis=alt.Axis(labelAngle=-45)),
+        y='Vote Count:Q',
+        tooltip=['Option:N', 'Vote Count:Q', 'Audience Count:Q']
+    ).properties(
+        title=f'Answer distribution for "{selected_slide["Slidetitle"]}"'
+    )
+    with col1:
+        st.altair_chart(chart4, use_container_width=True)
+
+slide_activity_df = deep_dive.slide_activity(presentation_id, pushdown)
+with col2:
+    st.subheader('Slide activity')
+    st.dataframe(slide_activity_df[['#', 'Slidetitle', 'Interaction Count', 'Audience Count']], hide_index=True)
@@ -1,19 +1,22 @@
 import streamlit as st
 import altair as alt
-from streamlist_interaction import create_stacked_category_bar_chart, enrich_audience_with_category, map_data_with_audience_category
-from warehouse_repo import get_interactions_of_presentation, get_polls_of_presentation
+from warehouse_repo import build_poll_crosstab, get_polls_of_presentation, poll_crosstab_pair
 
 st.set_page_config(layout="wide")
 
 params = st.query_params
 presentation_id = params.get('presentation_id', 7182146)
-df = get_polls_of_presentation(presentation_id)
 
-slide_ids = df['Slideid'].unique()
-slides = [{
-    'Slideid': slide_id,
-    'Slidetitle': df[df['Slideid'] == slide_id].iloc[0]['Slidetitle']
-} for slide_id in slide_ids]
+
+@st.cache_data(ttl='60m')
+def load_poll_crosstab(presentation_id):
+    # Every slide pair is computed at once, so changing the selection below is a matrix slice
+    return build_poll_crosstab(get_polls_of_presentation(presentation_id))
+
+
+crosstab = load_poll_crosstab(presentation_id)
+
+slides = crosstab['options'].drop_duplicates('Slideid')[['Slideid', 'Slidetitle']].to_dict('records')
 
 col1, col2 = st.columns([10, 2])
 
@@ -32,12 +35,9 @@ with col2:
 with col1:
     selected_first_slide = st.session_state.selected_first_slide
     selected_second_slide = st.session_state.selected_second_slide
-    unique_audience_data = map_data_with_audience_category(selected_second_slide, df)
-    unique_audience_data.rename(columns={'Chosen Poll_x': 'Chosen Poll'}, inplace=True)
-    unique_audience_data = unique_audience_data[unique_audience_data['Slideid'] == selected_first_slide['Slideid']]
-    unique_audience_data = unique_audience_data.groupby(['Presentationid', 'Slideid', 'Slidetitle', 'Slideorder', 'Chosen Poll', 'Category'])['audienceid'].nunique().reset_index().rename(columns={'Audienceid': 'Audience Count'})
+    unique_audience_data = poll_crosstab_pair(crosstab, selected_first_slide['Slideid'], selected_second_slide['Slideid'])
 
-    y_field = 'audienceid'
+    y_field = 'Audience Count'
     chart = alt.Chart(unique_audience_data).mark_bar().encode(
         x=alt.X('Chosen Poll:N', title='Chosen Answer',
                 axis=alt.Axis(labelAngle=-45)
@@ -49,4 +49,14 @@ with col1:
     ).properties(
         title=selected_first_slide['Slidetitle']
     )
-    st.altair_chart(chart, use_container_width=True)
\ No newline at end of file
+    st.altair_chart(chart, use_container_width=True)
+
+    heatmap = alt.Chart(unique_audience_data).mark_rect().encode(
+        x=alt.X('Chosen Poll:N', title='Chosen Answer', axis=alt.Axis(labelAngle=-45)),
+        y=alt.Y('Category:N', title=selected_second_slide['Slidetitle']),
+        color=f'{y_field}:Q',
+        tooltip=['Chosen Poll:N', 'Category:N', f'{y_field}:Q']
+    ).properties(
+        title='Cross-tab'
+    )
+    st.altair_chart(heatmap, use_container_width=True)
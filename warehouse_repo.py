@@ -1,67 +1,276 @@
 from re import I
-from typing import List
-from redshift_api import execute
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+from redshift_api import FETCH_CHUNK_SIZE, REDSHIFT_MAX_OVERFLOW, REDSHIFT_POOL_SIZE, execute_frame, execute_staged_frame, iter_frames
+import result_cache
+from query_registry import register_approximate_query, register_query
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import json
-import ast
+import re
+import os
+import threading
+from collections import OrderedDict
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+
+def _quoted(cols: List[str]):
+    return ", ".join(f'"{col}"' for col in cols)
+
+
+PRESENTATIONS_OF_USER = register_query(
+    'presentations_of_user',
+    'SELECT "id", "userid", "name", "createdat" FROM aha_report_x.dim_presentations WHERE userid = :user_id;'
+)
 
 
 def get_presentations_of_user(user_id: str):
-    sql = f'SELECT "id", "userid", "name", "createdat" FROM aha_report_x.dim_presentations WHERE userid = {user_id};'
-    rows = execute(sql)
-    return pd.DataFrame(rows, columns=['id', 'userid', 'name', 'createdat'])
+    return execute_frame(PRESENTATIONS_OF_USER, {'user_id': int(user_id)}, columns=['id', 'userid', 'name', 'createdat'])
 
 
-def get_interactions_of_presentation(presentation_id: str):
-    # One source of truth
-    cols = [
-        "Presentationid",
-        "Slideid",
-        "Slidetitle",
-        "Slidetypenormalized",
-        "Slideoptions",
-        "Slideorder",
-        "audience_name",
-        "audienceid",
-        "correct",
-        "Vote",
-        "poll_vote",
-        "Title",
-        "Createdat"
-    ]
-    cols_str = [f'"{col}"' for col in cols]
-    sql = f'SELECT {", ".join(cols_str)} FROM aha_report_x.mart_presentation_interactions WHERE presentationid = {presentation_id} AND createdat >= dateadd(day, -90, getdate());'
-    rows = execute(sql)
-    df = pd.DataFrame(rows, columns=cols)
-    df['Audience Name'] = df['audience_name']
+# One source of truth
+INTERACTION_COLUMNS = [
+    "Presentationid",
+    "Slideid",
+    "Slidetitle",
+    "Slidetypenormalized",
+    "Slideorder",
+    "audience_name",
+    "audienceid",
+    "correct",
+    "Vote",
+    "poll_vote",
+    "Title",
+    "Createdat"
+]
+# Repeated ids and strings are dictionary encoded at load time, so the cached frame stores
+# each distinct value once and groupbys/merges run on integer codes
+INTERACTION_CATEGORICAL_COLUMNS = ["Slidetitle", "Slidetypenormalized", "audience_name", "audienceid", "Vote", "Title"]
+# Slideid stays int64, it is the join key with points and slide options
+INTERACTION_INTEGER_COLUMNS = ["Presentationid", "Slideorder"]
+
+
+def compact_interactions(df: pd.DataFrame):
+    """
+    Categorical strings and downcast integers for an interactions frame.
+    Group by these columns with observed=True, otherwise unused category combinations are emitted.
+    """
+    df = df.astype({col: 'category' for col in INTERACTION_CATEGORICAL_COLUMNS if col in df.columns})
+    for col in INTERACTION_INTEGER_COLUMNS:
+        if col in df.columns:
+            # Stays float when the column has NULLs
+            df[col] = pd.to_numeric(df[col], downcast='integer')
     return df
 
 
+INTERACTIONS_OF_PRESENTATION = register_query(
+    'interactions_of_presentation',
+    f'SELECT {_quoted(INTERACTION_COLUMNS)} FROM aha_report_x.mart_presentation_interactions '
+    'WHERE presentationid = :presentation_id AND createdat >= dateadd(day, -90, getdate());'
+)
+
+
+def get_interactions_of_presentation(presentation_id: str):
+    df = execute_frame(INTERACTIONS_OF_PRESENTATION, {'presentation_id': int(presentation_id)}, columns=INTERACTION_COLUMNS)
+    return compact_interactions(df)
+
+
+def iter_interactions_of_presentation(presentation_id: str, chunk_size: int = FETCH_CHUNK_SIZE):
+    """
+    Streaming variant of get_interactions_of_presentation: yields DataFrame batches of at most
+    `chunk_size` rows, so memory stays bounded for very large presentations.
+    """
+    yield from iter_frames(INTERACTIONS_OF_PRESENTATION, {'presentation_id': int(presentation_id)},
+                           columns=INTERACTION_COLUMNS, chunk_size=chunk_size)
+
+
+SLIDE_STATS_COLUMNS = ['Slideid', 'Slidetitle', 'Slidetypenormalized', 'Slideorder', 'Interaction Count', 'Audience Count']
+
+
+def aggregate_slide_stats(batches):
+    """
+    Interaction count and unique audience count per slide, folded batch by batch.
+    Only per slide counts and distinct (slide, audience) pairs are kept between batches.
+
+    Args:
+        batches: Iterable of interaction DataFrames, e.g. iter_interactions_of_presentation(...)
+
+    Returns:
+        DataFrame with SLIDE_STATS_COLUMNS, sorted by 'Slideorder'
+    """
+    slide_cols = SLIDE_STATS_COLUMNS[:4]
+    slides = None
+    counts = pd.Series(dtype='int64')
+    # Per batch distinct pairs are buffered and only merged once the buffer has grown past the
+    # merged set, so each pair is deduplicated a constant number of times on average
+    pairs, buffered, distinct = [], 0, 0
+    for batch in batches:
+        batch_slides = batch[slide_cols].drop_duplicates('Slideid')
+        slides = batch_slides if slides is None else pd.concat([slides, batch_slides]).drop_duplicates('Slideid')
+        counts = counts.add(batch.groupby('Slideid').size(), fill_value=0)
+        # Like nunique, a missing audienceid is not an audience
+        batch_pairs = batch[['Slideid', 'audienceid']].dropna().drop_duplicates()
+        pairs.append(batch_pairs)
+        buffered += len(batch_pairs)
+        if buffered > 2 * distinct:
+            pairs = [pd.concat(pairs).drop_duplicates()]
+            buffered = distinct = len(pairs[0])
+
+    if slides is None:
+        return pd.DataFrame(columns=SLIDE_STATS_COLUMNS)
+    result = slides.set_index('Slideid')
+    result['Interaction Count'] = counts.astype(int)
+    result['Audience Count'] = pd.concat(pairs).drop_duplicates().groupby('Slideid').size()
+    result['Audience Count'] = result['Audience Count'].fillna(0).astype(int)
+    return result.reset_index()[SLIDE_STATS_COLUMNS].sort_values(by='Slideorder').reset_index(drop=True)
+
+
+SLIDES_OF_PRESENTATION = register_query('slides_of_presentation', """
+    SELECT "Slideid", MAX("Slidetitle"), MAX("Slidetypenormalized"), MIN("Slideorder")
+    FROM aha_report_x.mart_presentation_interactions
+    WHERE presentationid = :presentation_id
+    AND createdat >= dateadd(day, -90, getdate())
+    GROUP BY "Slideid"
+""")
+
+
+def build_slide_dimension(slides: pd.DataFrame):
+    """
+    Slide numbering and display labels, formatted once per slide.
+
+    Args:
+        slides: One row per slide with 'Slideid', 'Slidetitle', 'Slidetypenormalized' and 'Slideorder'
+
+    Returns:
+        DataFrame with 'Slideid', 'Slideorder', 'Index', '#', 'Slidetypenormalized', 'Slidetitle'
+        ('(empty)' for missing titles) and '# Slidetitle', sorted by 'Slideorder'
+    """
+    dim = slides.sort_values(by=['Slideorder', 'Slideid']).reset_index(drop=True)
+    dim['Slideid'] = dim['Slideid'].astype('int64')
+    dim['Slidetitle'] = dim['Slidetitle'].fillna('(empty)').astype(str)
+    dim['Index'] = np.arange(1, len(dim) + 1)
+    dim['#'] = dim['Index']
+    dim['# Slidetitle'] = '#' + dim['Index'].astype(str) + ' - ' + dim['Slidetitle']
+    # Fact frames join on Slideid and get these labels as categorical codes
+    dim = dim.astype({'Slidetitle': 'category', '# Slidetitle': 'category', 'Slidetypenormalized': 'category'})
+    return dim[['Slideid', 'Slideorder', 'Index', '#', 'Slidetypenormalized', 'Slidetitle', '# Slidetitle']]
+
+
+def get_slide_dimension(presentation_id: str):
+    """
+    Slide dimension of a presentation, see build_slide_dimension. The slide list is a cached query.
+    """
+    slides = execute_frame(SLIDES_OF_PRESENTATION, {'presentation_id': int(presentation_id)},
+                           columns=['Slideid', 'Slidetitle', 'Slidetypenormalized', 'Slideorder'])
+    return build_slide_dimension(slides)
+
+
+POLLS_OF_PRESENTATION = register_query(
+    'polls_of_presentation',
+    f'SELECT {_quoted(INTERACTION_COLUMNS)} FROM aha_report_x.mart_presentation_interactions '
+    'WHERE presentationid = :presentation_id AND createdat >= dateadd(day, -90, getdate()) '
+    'AND "Slidetypenormalized" = \'Poll\';'
+)
+
+
 def get_polls_of_presentation(presentation_id: str):
-    df = get_interactions_of_presentation(presentation_id)
-    df = df[df['Slidetypenormalized'] == 'Poll'].copy()
-    df['Chosen Poll'] = df.apply(lambda x: extract_poll_value(x['Slidetitle'], x['Slideoptions'], x['poll_vote']), axis=1)
+    # The Poll filter is pushed down, only poll interactions are transferred
+    df = execute_frame(POLLS_OF_PRESENTATION, {'presentation_id': int(presentation_id)}, columns=INTERACTION_COLUMNS)
+    df = compact_interactions(df)
+    df = decode_answers(df, get_slide_option_table(presentation_id))
     return df
 
+
+# One source of truth
+POINT_COLUMNS = [
+    "Slideid",
+    "audienceid",
+    "Earned_points",
+    "Bonus_points"
+]
+POINTS_OF_PRESENTATION = register_query(
+    'points_of_presentation',
+    f'SELECT {_quoted(POINT_COLUMNS)} FROM aha_report_x.fct_points WHERE presentationid = :presentation_id;'
+)
+
+
 def get_points_of_presentation(presentation_id: str):
-    # One source of truth
-    cols = [
-        "Slideid",
-        "audienceid",
-        "Earned_points",
-        "Bonus_points"
-    ]
-    cols_str = [f'"{col}"' for col in cols]
-    sql = f'SELECT {", ".join(cols_str)} FROM aha_report_x.fct_points WHERE presentationid = {presentation_id};'
-    rows = execute(sql)
-    return pd.DataFrame(rows, columns=cols)
+    return execute_frame(POINTS_OF_PRESENTATION, {'presentation_id': int(presentation_id)}, columns=POINT_COLUMNS)
 
 
-def get_participant_count_per_day(user_id: str, days: int = 60):
+class PointsCube:
     """
-    Temp function, may be useful for busy users. For now we use weeks since there is too little data.
+    fct_points of a presentation at (slide, audience) grain: integer slide and audience codes with
+    float32 earned and bonus points. Any segmentation of the audiences is one grouped reduction
+    over the codes, no merge with the points rows is needed.
     """
-    sql = f"""
+
+    def __init__(self, points_df: pd.DataFrame):
+        points_df = points_df.dropna(subset=['Slideid', 'audienceid', 'Earned_points', 'Bonus_points'])
+        self.slide_codes, self.slide_ids = pd.factorize(points_df['Slideid'])
+        self.audience_codes, self.audiences = pd.factorize(points_df['audienceid'])
+        self.earned = points_df['Earned_points'].to_numpy(dtype=np.float32)
+        self.bonus = points_df['Bonus_points'].to_numpy(dtype=np.float32)
+
+    def __len__(self):
+        return len(self.slide_codes)
+
+    def _segment_rows(self, audience_segments: pd.DataFrame):
+        # Expand every points row into one row per segment its audience belongs to
+        segments = audience_segments[['audienceid', 'Segment']].dropna().drop_duplicates()
+        segment_codes, labels = pd.factorize(segments['Segment'])
+        audience_codes = pd.Index(self.audiences).get_indexer(segments['audienceid'])
+        known = audience_codes >= 0
+        order = np.lexsort((segment_codes[known], audience_codes[known]))
+        member_audiences, member_segments = audience_codes[known][order], segment_codes[known][order]
+
+        per_audience = np.bincount(member_audiences, minlength=len(self.audiences))
+        starts = np.cumsum(per_audience) - per_audience
+        repeats = per_audience[self.audience_codes]
+        rows = np.repeat(np.arange(len(self)), repeats)
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        return rows, member_segments[starts[self.audience_codes[rows]] + offsets], labels
+
+    def mean_by_segment(self, audience_segments: pd.DataFrame = None):
+        """
+        Average points per slide x segment.
+
+        Args:
+            audience_segments: 'audienceid' -> 'Segment' rows, an audience can be in several segments.
+                Audiences without a segment are left out. When omitted, every audience is in 'All'.
+
+        Returns:
+            DataFrame with 'Slideid', 'Segment', 'Earned points' and 'Bonus points'
+        """
+        if audience_segments is None:
+            rows, segment_codes, labels = np.arange(len(self)), np.zeros(len(self), dtype=np.intp), pd.Index(['All'])
+        else:
+            rows, segment_codes, labels = self._segment_rows(audience_segments)
+
+        n_slides = len(self.slide_ids)
+        cells = segment_codes.astype(np.int64) * n_slides + self.slide_codes[rows]
+        size = len(labels) * n_slides
+        counts = np.bincount(cells, minlength=size)
+        earned = np.bincount(cells, weights=self.earned[rows], minlength=size)
+        bonus = np.bincount(cells, weights=self.bonus[rows], minlength=size)
+
+        filled = np.flatnonzero(counts)
+        return pd.DataFrame({
+            'Slideid': np.asarray(self.slide_ids)[filled % n_slides],
+            'Segment': np.asarray(labels)[filled // n_slides],
+            'Earned points': earned[filled] / counts[filled],
+            'Bonus points': bonus[filled] / counts[filled],
+        })
+
+    def mean_by_slide(self):
+        """
+        Average points per slide, the per presentation counterpart of get_avg_point_per_question.
+        """
+        return self.mean_by_segment().drop(columns=['Segment'])
+
+
+PARTICIPANT_COUNT_PER_DAY = register_query('participant_count_per_day', """
     WITH params AS (
     SELECT CAST(CONVERT_TIMEZONE('UTC','Asia/Bangkok', GETDATE()) AS date) AS local_today
     ),
@@ -76,7 +285,7 @@ def get_participant_count_per_day(user_id: str, days: int = 60):
     SELECT DATEADD(day, -n, p.local_today) AS event_day
     FROM nums
     CROSS JOIN params p
-    WHERE n BETWEEN 0 AND {days - 1}
+    WHERE n BETWEEN 0 AND CAST(:days AS int) - 1
     ),
     agg AS (
     SELECT
@@ -84,9 +293,9 @@ def get_participant_count_per_day(user_id: str, days: int = 60):
         COUNT(DISTINCT audienceid) AS unique_audience
     FROM aha_report_x.mart_presentation_interactions
     CROSS JOIN params p
-    WHERE userid = {user_id}
+    WHERE userid = :user_id
         AND CAST(CONVERT_TIMEZONE('UTC','Asia/Bangkok', "Createdat") AS date)
-            BETWEEN DATEADD(day, -{days - 1}, p.local_today) AND p.local_today
+            BETWEEN DATEADD(day, 1 - CAST(:days AS int), p.local_today) AND p.local_today
     GROUP BY 1
     )
     SELECT d.event_day,
@@ -94,21 +303,28 @@ def get_participant_count_per_day(user_id: str, days: int = 60):
     FROM days d
     LEFT JOIN agg a USING (event_day)
     ORDER BY d.event_day;
+""")
+PARTICIPANT_COUNT_PER_DAY_APPROXIMATE = register_approximate_query(PARTICIPANT_COUNT_PER_DAY)
+
+
+def get_participant_count_per_day(user_id: str, days: int = 60, approximate: bool = False):
+    """
+    Temp function, may be useful for busy users. For now we use weeks since there is too little data.
+    approximate=True counts with APPROXIMATE COUNT(DISTINCT), about 2% relative error.
     """
-    rows = execute(sql)
-    return pd.DataFrame(rows, columns=['event_day', 'unique_audience'])
+    query = PARTICIPANT_COUNT_PER_DAY_APPROXIMATE if approximate else PARTICIPANT_COUNT_PER_DAY
+    return execute_frame(query, {'user_id': int(user_id), 'days': int(days)}, columns=['event_day', 'unique_audience'])
 
 
 
-def get_participant_count_per_week_raw(user_id: int, weeks: int = 12):
-    sql = f"""
+PARTICIPANT_COUNT_PER_WEEK = register_query('participant_count_per_week', """
     WITH params AS (
       SELECT CONVERT_TIMEZONE('UTC','Asia/Bangkok', GETDATE())::date AS local_today
     ),
     anchor AS (
       SELECT
         DATE_TRUNC('week', local_today)::date                                           AS week_start_today,
-        DATEADD(week, CAST(-({weeks}-1) AS int), DATE_TRUNC('week', local_today))::date AS lower_bound,
+        DATEADD(week, CAST(1 - :weeks AS int), DATE_TRUNC('week', local_today))::date    AS lower_bound,
         DATEADD(week, 1, DATE_TRUNC('week', local_today))::date                         AS next_week_start
       FROM params
     )
@@ -116,25 +332,23 @@ def get_participant_count_per_week_raw(user_id: int, weeks: int = 12):
       DATE_TRUNC('week', CONVERT_TIMEZONE('UTC','Asia/Bangkok', "Createdat"))::date AS week_start,
       COUNT(DISTINCT audienceid) AS unique_audience
     FROM aha_report_x.mart_presentation_interactions, anchor a
-    WHERE userid = {user_id}
+    WHERE userid = :user_id
       AND CONVERT_TIMEZONE('UTC','Asia/Bangkok', "Createdat")::date >= a.lower_bound
       AND CONVERT_TIMEZONE('UTC','Asia/Bangkok', "Createdat")::date <  a.next_week_start
     GROUP BY 1
     ORDER BY 1
     LIMIT 1000;
-    """
-    rows = execute(sql)
-    return pd.DataFrame(rows, columns=['week_start', 'unique_audience'])
+""")
+PARTICIPANT_COUNT_PER_WEEK_APPROXIMATE = register_approximate_query(PARTICIPANT_COUNT_PER_WEEK)
 
-import datetime as dt
 
-def fill_missing_weeks(df: pd.DataFrame, weeks: int = 12, tz: str = 'Asia/Bangkok'):
-    # Ensure schema
-    if df.empty:
-        df = pd.DataFrame(columns=['week_start', 'unique_audience'])
-    df = df.copy()
-    df['week_start'] = pd.to_datetime(df['week_start']).dt.date  # -> python date
+def get_participant_count_per_week_raw(user_id: int, weeks: int = 12, approximate: bool = False):
+    query = PARTICIPANT_COUNT_PER_WEEK_APPROXIMATE if approximate else PARTICIPANT_COUNT_PER_WEEK
+    return execute_frame(query, {'user_id': int(user_id), 'weeks': int(weeks)}, columns=['week_start', 'unique_audience'])
 
+import datetime as dt
+
+def _expected_week_starts(weeks: int, tz: str = 'Asia/Bangkok'):
     # Monday-start of current local week as a python date
     now_local = pd.Timestamp.now(tz=tz)
     week_start_today = (now_local - pd.Timedelta(days=now_local.weekday())).date()
@@ -142,25 +356,130 @@ def fill_missing_weeks(df: pd.DataFrame, weeks: int = 12, tz: str = 'Asia/Bangko
     # Build expected Monday starts (no extra .date() here)
     expected = [week_start_today - dt.timedelta(weeks=i) for i in range(weeks)]
     expected.sort()  # ascending
+    return expected
+
+
+def fill_missing_weeks(df: pd.DataFrame, weeks: int = 12, tz: str = 'Asia/Bangkok'):
+    # Ensure schema
+    if df.empty:
+        df = pd.DataFrame(columns=['week_start', 'unique_audience'])
+    df = df.copy()
+    df['week_start'] = pd.to_datetime(df['week_start']).dt.date  # -> python date
 
-    spine = pd.DataFrame({'week_start': expected})
+    spine = pd.DataFrame({'week_start': _expected_week_starts(weeks, tz)})
     out = spine.merge(df, on='week_start', how='left')
     out['unique_audience'] = out['unique_audience'].fillna(0).astype(int)
     return out
 
 
-def get_participant_count_per_week_v2(user_id: int, weeks: int = 12):
-    raw = get_participant_count_per_week_raw(user_id=user_id, weeks=weeks)
+PARTICIPANT_COUNT_FOR_WEEKS = register_query('participant_count_for_weeks', """
+    SELECT
+      DATE_TRUNC('week', CONVERT_TIMEZONE('UTC','Asia/Bangkok', "Createdat"))::date AS week_start,
+      COUNT(DISTINCT audienceid) AS unique_audience
+    FROM aha_report_x.mart_presentation_interactions
+    WHERE userid = :user_id
+      AND CONVERT_TIMEZONE('UTC','Asia/Bangkok', "Createdat")::date >= :lower_bound
+      AND CONVERT_TIMEZONE('UTC','Asia/Bangkok', "Createdat")::date <  :upper_bound
+    GROUP BY 1
+    ORDER BY 1;
+""")
+PARTICIPANT_COUNT_FOR_WEEKS_APPROXIMATE = register_approximate_query(PARTICIPANT_COUNT_FOR_WEEKS)
+
+# Closed weeks never change, so their counts are kept in the result cache and never refreshed.
+# Like any other entry they count towards its byte budget, and nothing is stored when it is disabled.
+
+# Late loads into the mart can still land shortly after a week ends
+CLOSED_WEEK_GRACE_DAYS = 1
+
+
+def _closed_weeks_key(user_id: int, approximate: bool = False):
+    # Approximate counts are stored apart, they never replace exact ones
+    return 'closed_weeks', int(user_id), bool(approximate)
+
+
+def _read_closed_weeks(user_id: int, approximate: bool = False):
+    if not result_cache.is_enabled():
+        return {}
+    cached = result_cache.read(_closed_weeks_key(user_id, approximate))
+    if cached is None:
+        return {}
+    df = cached[0].to_pandas()
+    return dict(zip(pd.to_datetime(df['week_start']).dt.date, df['unique_audience']))
+
+
+def _write_closed_weeks(user_id: int, counts: dict, approximate: bool = False):
+    if not result_cache.is_enabled():
+        return
+    df = pd.DataFrame({'week_start': list(counts.keys()), 'unique_audience': list(counts.values())})
+    result_cache.write(_closed_weeks_key(user_id, approximate), pa.Table.from_pandas(df.sort_values('week_start'), preserve_index=False))
+
+
+def _count_weeks(user_id: int, week_starts: List[dt.date], approximate: bool = False, cache: bool = True):
+    query = PARTICIPANT_COUNT_FOR_WEEKS_APPROXIMATE if approximate else PARTICIPANT_COUNT_FOR_WEEKS
+    df = execute_frame(query, {
+        'user_id': int(user_id),
+        'lower_bound': min(week_starts),
+        'upper_bound': max(week_starts) + dt.timedelta(weeks=1),
+    }, columns=['week_start', 'unique_audience'], cache=cache)
+    counts = dict(zip(pd.to_datetime(df['week_start']).dt.date, df['unique_audience'].astype(int)))
+    return {week: counts.get(week, 0) for week in week_starts}
+
+
+def get_participant_count_per_week_incremental(user_id: int, weeks: int = 12, tz: str = 'Asia/Bangkok', approximate: bool = False):
+    """
+    Weekly unique audience counts where closed weeks are read from the permanent store
+    and only the weeks that can still change (usually just the current one) hit Redshift.
+    """
+    expected = _expected_week_starts(weeks, tz)
+    today = pd.Timestamp.now(tz=tz).date()
+    closed = [week for week in expected
+              if week + dt.timedelta(weeks=1, days=CLOSED_WEEK_GRACE_DAYS) <= today]
+    open_weeks = [week for week in expected if week not in closed]
+
+    stored = _read_closed_weeks(user_id, approximate)
+    missing = [week for week in closed if week not in stored]
+    if missing:
+        # Fresh counts only: a cached result for the same range may predate the week closing,
+        # and whatever is written here is never recomputed
+        stored.update(_count_weeks(user_id, missing, approximate, cache=False))
+        _write_closed_weeks(user_id, stored, approximate)
+
+    counts = {week: stored[week] for week in closed}
+    if open_weeks:
+        counts.update(_count_weeks(user_id, open_weeks, approximate))
+    return pd.DataFrame({'week_start': expected, 'unique_audience': [int(counts[week]) for week in expected]})
+
+
+def get_participant_count_per_week_v2(user_id: int, weeks: int = 12, incremental: bool = True, approximate: bool = False):
+    """
+    Weekly unique audience counts. approximate=True trades about 2% accuracy for
+    APPROXIMATE COUNT(DISTINCT) in Redshift, for large tenants.
+    """
+    if incremental:
+        return get_participant_count_per_week_incremental(user_id=user_id, weeks=weeks, approximate=approximate)
+    raw = get_participant_count_per_week_raw(user_id=user_id, weeks=weeks, approximate=approximate)
     filled = fill_missing_weeks(raw, weeks=weeks)  # adds zero rows for missing weeks
     return filled
 
 
 
+_VOTE_TOKEN = re.compile(r'[^\s,\[\]\'"]+')
+
+
+def parse_vote(vote):
+    """
+    Option ids of a Vote string such as '[123, 456]', without going through ast.literal_eval.
+    """
+    if type(vote) != str:
+        return []
+    return [int(token) if token.lstrip('-').isdigit() else token for token in _VOTE_TOKEN.findall(vote)]
+
+
 def extract_quiz_value(slide_title, slide_options, vote):
     if vote is None or type(vote) == float or type(slide_options) != str:
         return None
     else:
-        vote = ast.literal_eval(vote)
+        vote = parse_vote(vote)
         if len(vote) == 0:
             return None
         data = json.loads(slide_options)
@@ -186,99 +505,638 @@ def extract_short_answer(slide_title, short_answer):
         return f'Answered: `{short_answer}` for "{slide_title}"'
 
 
-def get_audience_segment(selected_slide, df, audience_id_field):
-    slide_type = df[df['Slideid'] == selected_slide['Slideid']]['Slidetypenormalized'].iloc[0]
+SLIDE_VERSIONS_OF_PRESENTATION = register_query('slide_versions_of_presentation', """
+    SELECT id, updatedat FROM aha_report_x.dim_slides WHERE presentationid = :presentation_id
+""")
+
+SLIDE_OPTIONS = register_query('slide_options', """
+    SELECT id, updatedat, options FROM aha_report_x.dim_slides WHERE id IN :slide_ids
+""", expanding=['slide_ids'])
+
+# Process wide (Slideid, updatedat) -> [(option_id, option_title), ...], shared by all sessions.
+# An edited slide gets a new updatedat, so its old entry is simply never read again.
+SLIDE_OPTION_CACHE_MAX_ENTRIES = int(os.getenv("SLIDE_OPTION_CACHE_MAX_ENTRIES", 100_000))
+_slide_options = OrderedDict()
+_slide_options_lock = threading.Lock()
+
+
+def _parse_slide_options(options):
+    if type(options) != str:
+        return []
+    # Formatted like the f-string in extract_poll_value, so a null title reads 'None'
+    return [(option['id'], str(option['title'])) for option in json.loads(options)]
+
+
+def _load_slide_options(keys):
+    with _slide_options_lock:
+        missing = [key for key in keys if key not in _slide_options]
+    if not missing:
+        return
+    # Bypass the result cache: a cached row could belong to an older version of the slide
+    df = execute_frame(SLIDE_OPTIONS, {'slide_ids': sorted({slide_id for slide_id, _ in missing})},
+                       columns=['Slideid', 'updatedat', 'options'], cache=False)
+    fetched = {int(slide_id): _parse_slide_options(options) for slide_id, options in zip(df['Slideid'], df['options'])}
+    with _slide_options_lock:
+        # Stored under the requested version: if the slide was edited in between, the next
+        # version read returns a new key and fetches it again
+        for key in missing:
+            if key[0] in fetched:
+                _slide_options[key] = fetched[key[0]]
+        while len(_slide_options) > SLIDE_OPTION_CACHE_MAX_ENTRIES:
+            _slide_options.popitem(last=False)
+
+
+def get_slide_option_table(presentation_id: str):
+    """
+    Options of every slide of a presentation, from the shared slide-option dictionary.
+    Only slides that are new or were edited since they were last seen are fetched from dim_slides.
+
+    Returns:
+        DataFrame with one row per ('Slideid', 'option_id') and its 'option_title'
+    """
+    # Read fresh, a cached version list would keep serving the options of edited slides
+    versions = execute_frame(SLIDE_VERSIONS_OF_PRESENTATION, {'presentation_id': int(presentation_id)},
+                             columns=['Slideid', 'updatedat'], cache=False)
+    keys = [(int(slide_id), updated_at) for slide_id, updated_at in zip(versions['Slideid'], versions['updatedat'])]
+    _load_slide_options(keys)
+
+    records = []
+    with _slide_options_lock:
+        for key in keys:
+            if key in _slide_options:
+                _slide_options.move_to_end(key)
+                records.extend((key[0], option_id, title) for option_id, title in _slide_options[key])
+    table = pd.DataFrame(records, columns=['Slideid', 'option_id', 'option_title'])
+    table['Slideid'] = table['Slideid'].astype('int64')
+    table['option_id'] = pd.to_numeric(table['option_id'], errors='coerce')
+    # First match wins, like the linear search in extract_poll_value
+    return table.dropna(subset=['option_id']).drop_duplicates(['Slideid', 'option_id'])
+
+
+def _lookup_option_titles(slide_ids, option_ids: pd.Series, option_table: pd.DataFrame):
+    keys = pd.DataFrame({'Slideid': slide_ids, 'option_id': pd.to_numeric(option_ids, errors='coerce').to_numpy()})
+    matched = keys.merge(option_table, on=['Slideid', 'option_id'], how='left', indicator=True)
+    return matched['option_title'].to_numpy(), (matched['_merge'] == 'both').to_numpy()
+
+
+def _answer_labels(answers, slide_titles: pd.Series, mask):
+    # Format each distinct (answer, slide title) pair once, then broadcast back to the rows
+    pairs = pd.DataFrame({'answer': answers, 'slide_title': slide_titles.to_numpy()}, dtype=object)[mask]
+    distinct = pairs.drop_duplicates()
+    distinct['label'] = [f'Answered: `{answer}` for "{slide_title}"' for answer, slide_title in zip(distinct['answer'], distinct['slide_title'])]
+    labels = pd.Series(None, index=slide_titles.index, dtype=object)
+    labels[mask] = pairs.merge(distinct, on=['answer', 'slide_title'], how='left')['label'].to_numpy()
+    return labels
+
+
+def parse_first_vote(votes: pd.Series):
+    """
+    First chosen option id of Vote strings such as '[123, 456]', NaN for missing or empty votes.
+    """
+    codes, uniques = pd.factorize(votes)
+    if len(uniques) == 0:
+        return pd.Series(float('nan'), index=votes.index)
+    first = pd.Series(uniques, dtype=object).str.extract(r'^\s*\[\s*[\'"]?([^,\'"\]\s]+)', expand=False)
+    first = pd.to_numeric(first, errors='coerce').to_numpy()
+    return pd.Series(np.where(codes >= 0, first[codes], np.nan), index=votes.index)
+
+
+def parse_votes(votes: pd.Series):
+    """
+    Vote strings as a list column of chosen option ids, parsing each distinct string once.
+    Missing votes become empty lists.
+    """
+    codes, uniques = pd.factorize(votes)
+    parsed = np.empty(len(uniques) + 1, dtype=object)
+    parsed[:-1] = [parse_vote(vote) for vote in uniques]
+    parsed[-1] = []
+    # Code -1 (missing) picks the trailing empty list
+    return pd.Series(parsed[codes], index=votes.index)
+
+
+def explode_votes(df: pd.DataFrame):
+    """
+    One row per chosen option of every Pick Answer interaction, with a numeric 'option_id'.
+    """
+    votes = df.loc[df['Slidetypenormalized'] == 'Pick Answer', ['Slideid', 'audienceid', 'Vote']]
+    votes = votes.assign(option_id=parse_votes(votes['Vote'])).explode('option_id')
+    votes['option_id'] = pd.to_numeric(votes['option_id'], errors='coerce')
+    return votes.dropna(subset=['option_id'])[['Slideid', 'audienceid', 'option_id']]
+
+
+def get_answer_distribution(df: pd.DataFrame, slide_option_table: pd.DataFrame):
+    """
+    Per option histogram of Pick Answer slides, counting every option of multi-select votes.
+
+    Returns:
+        DataFrame with 'Slideid', 'option_id', 'Option', 'Vote Count' and 'Audience Count'
+    """
+    votes = explode_votes(df)
+    distribution = votes.groupby(['Slideid', 'option_id']).agg(
+        **{'Vote Count': ('audienceid', 'size'), 'Audience Count': ('audienceid', 'nunique')}).reset_index()
+    distribution = distribution.merge(slide_option_table, on=['Slideid', 'option_id'], how='left')
+    distribution['Option'] = distribution['option_title'].fillna('Unknown option')
+    return distribution[['Slideid', 'option_id', 'Option', 'Vote Count', 'Audience Count']]
+
+
+def decode_answers(df: pd.DataFrame, slide_option_table: pd.DataFrame):
+    """
+    Vectorized equivalent of applying extract_quiz_value, extract_poll_value and extract_short_answer
+    per row. Votes are resolved with a merge against the options of each slide.
+
+    Args:
+        df: Interactions with 'Slideid', 'Slidetitle', 'Vote', 'poll_vote' and 'Title'
+        slide_option_table: Options per 'Slideid', e.g. get_slide_option_table(...)
+
+    Adds 'Chosen Pick Answer', 'Chosen Poll' and 'Chosen Short Answer' to `df` and returns it.
+    """
+    slide_ids = pd.to_numeric(df['Slideid'], errors='coerce').to_numpy()
+
+    quiz_titles, quiz_matched = _lookup_option_titles(slide_ids, parse_first_vote(df['Vote']), slide_option_table)
+    df['Chosen Pick Answer'] = _answer_labels(quiz_titles, df['Slidetitle'], quiz_matched)
+
+    poll_titles, poll_matched = _lookup_option_titles(slide_ids, df['poll_vote'], slide_option_table)
+    df['Chosen Poll'] = _answer_labels(poll_titles, df['Slidetitle'], poll_matched)
+
+    short_answered = (df['Title'].notna() & (df['Title'] != 'nan')).to_numpy()
+    df['Chosen Short Answer'] = _answer_labels(df['Title'].to_numpy(), df['Slidetitle'], short_answered)
+    return df
+
+
+def _slide_audience_segment(slide_df, audience_id_field):
+    """
+    audience -> 'Segment' rows of the segmenting slide. Empty when the slide has no interactions
+    or its type has no segments.
+    """
+    if slide_df.empty:
+        return pd.DataFrame(columns=[audience_id_field, 'Segment'])
+    slide_type = slide_df['Slidetypenormalized'].iloc[0]
     if slide_type == 'Poll':
-        audience_df = df[df['Slideid'] == selected_slide['Slideid']][[audience_id_field, 'Chosen Poll']]
+        audience_df = slide_df[[audience_id_field, 'Chosen Poll']].copy()
         audience_df['Segment'] = audience_df['Chosen Poll'].fillna('No Category')
         return audience_df
     if slide_type == 'Open Ended':
-        audience_df = df[df['Slideid'] == selected_slide['Slideid']][[audience_id_field, 'Chosen Short Answer']]
+        audience_df = slide_df[[audience_id_field, 'Chosen Short Answer']].copy()
         audience_df['Segment'] = audience_df['Chosen Short Answer'].fillna('No Category')
         return audience_df
     if slide_type == 'Pick Answer':
-        audience_df = df[df['Slideid'] == selected_slide['Slideid']][[audience_id_field, 'correct']]
-        slide_title = df[df['Slideid'] == selected_slide['Slideid']]['Slidetitle'].iloc[0]
-        audience_df['correct'] = audience_df['correct'].fillna('No Category')
-        audience_df['correct'] = audience_df['correct'].apply(lambda x: f'Answered Correctly to `{slide_title}`' if x == 'correct' else f'Answered Incorrectly to `{slide_title}`')
-        audience_df.rename(columns={'correct': 'Segment'}, inplace=True)
+        slide_title = slide_df['Slidetitle'].iloc[0]
+        audience_df = slide_df[[audience_id_field]].copy()
+        audience_df['Segment'] = np.where(slide_df['correct'] == 'correct',
+                                          f'Answered Correctly to `{slide_title}`',
+                                          f'Answered Incorrectly to `{slide_title}`')
         return audience_df
+    return pd.DataFrame(columns=[audience_id_field, 'Segment'])
+
+
+def get_audience_segment(selected_slide, df, audience_id_field):
+    return _slide_audience_segment(df[df['Slideid'] == selected_slide['Slideid']], audience_id_field)
+
+
+class SegmentIndex:
+    """
+    Row positions of every slide of an interactions frame, grouped once, and the audience -> segment
+    frame of each slide, computed on first use. A lookup only touches the rows of that slide.
+    """
+
+    def __init__(self, df: pd.DataFrame, audience_id_field: str = 'audienceid'):
+        self.df = df
+        self.audience_id_field = audience_id_field
+        self._positions = df.groupby('Slideid', sort=False, observed=True).indices
+        self._segments = {}
+
+    def slide_rows(self, slide_id):
+        return self.df.iloc[self._positions.get(slide_id, [])]
+
+    def audience_segment(self, slide_id):
+        if slide_id not in self._segments:
+            self._segments[slide_id] = _slide_audience_segment(self.slide_rows(slide_id), self.audience_id_field)
+        return self._segments[slide_id]
+
+
+def _audience_segment(selected_slide, df, audience_id_field, segment_index):
+    if segment_index is None:
+        return get_audience_segment(selected_slide, df, audience_id_field)
+    return segment_index.audience_segment(selected_slide['Slideid'])
 
 
-def map_data_with_audience_category(selected_slide, df):
+def map_data_with_audience_category(selected_slide, df, segment_index: SegmentIndex = None):
     audience_id_field = 'audienceid'
-    audience_segment = get_audience_segment(selected_slide, df, audience_id_field)
+    audience_segment = _audience_segment(selected_slide, df, audience_id_field, segment_index)
     data = df.merge(audience_segment, on=audience_id_field, how='left')
     return data
 
 
-def map_point_with_audience_segment(selected_slide, df, points_df):
+def map_point_with_audience_segment(selected_slide, df, points_df, segment_index: SegmentIndex = None):
     audience_id_field = 'audienceid'
-    audience_segment = get_audience_segment(selected_slide, df, audience_id_field)
+    audience_segment = _audience_segment(selected_slide, df, audience_id_field, segment_index)
     return points_df.merge(audience_segment, on=audience_id_field, how='left')
 
 
-def enrich_points_with_audience_segment(selected_slide, df, points_df):
+def enrich_points_with_audience_segment(selected_slide, df, points_df, segment_index: SegmentIndex = None):
     if selected_slide['Slideid'] != 'All':
-        return map_point_with_audience_segment(selected_slide, df, points_df)
+        return map_point_with_audience_segment(selected_slide, df, points_df, segment_index)
     else:
         data = points_df.copy()
         data['Segment'] = 'All'
         return data
 
 
-def enrich_audience_with_category(selected_slide, df):
+def enrich_audience_with_category(selected_slide, df, segment_index: SegmentIndex = None):
     if selected_slide['Slideid'] != 'All':
-        return map_data_with_audience_category(selected_slide, df)
+        return map_data_with_audience_category(selected_slide, df, segment_index)
     else:
         data = df.copy()
         data['Segment'] = 'All'
         return data
 
 
-def get_avg_point_per_question(user_id: int):
-    sql = f"""
+SEGMENT_STATS_COLUMNS = ['Slideid', 'Slidetitle', 'Slidetypenormalized', 'Slideorder', 'Segment',
+                         'Interaction Count', 'Audience Count', 'Segment Audience Count']
+
+
+def aggregate_segment_stats(df: pd.DataFrame, selected_slide, segment_index: SegmentIndex = None):
+    """
+    Local equivalent of get_slide_segment_stats, without merging the interactions with the segments.
+
+    Audiences and segments are integer coded into (audience, segment) member pairs, and every
+    interaction row is expanded once per segment its audience belongs to. Counts are then a single
+    bincount over slide x segment cells, so the cost follows the expanded rows, not rows x segments.
+    In 'All' mode interactions without an audience id still count as interactions; with a
+    segmenting slide they belong to no segment.
+
+    Returns:
+        Dict with
+            'slides': DataFrame with 'Slideid', 'Slidetitle', 'Slidetypenormalized', 'Slideorder', 'Segment',
+                      'Interaction Count', 'Audience Count', 'Segment Audience Count'
+            'total_audience': number of unique audiences of the presentation
+    """
+    audience_codes, audiences = pd.factorize(df['audienceid'])
+    slide_codes, slide_ids = pd.factorize(df['Slideid'])
+    n_audiences, n_slides = len(audiences), len(slide_ids)
+
+    if selected_slide['Slideid'] == 'All':
+        segments = pd.Index(['All'])
+        rows, row_segments = np.arange(len(df)), np.zeros(len(df), dtype=np.intp)
+        segment_audiences = np.array([n_audiences])
+    else:
+        audience_segment = _audience_segment(selected_slide, df, 'audienceid', segment_index)
+        audience_segment = audience_segment[['audienceid', 'Segment']].drop_duplicates()
+        segment_codes, segments = pd.factorize(audience_segment['Segment'])
+        member_audiences = pd.Index(audiences).get_indexer(audience_segment['audienceid'])
+        known = member_audiences >= 0
+        order = np.lexsort((segment_codes[known], member_audiences[known]))
+        member_audiences, member_segments = member_audiences[known][order], segment_codes[known][order]
+        segment_audiences = np.bincount(member_segments, minlength=len(segments))
+
+        # Expand every interaction row into one row per segment of its audience, CSR style
+        per_audience = np.bincount(member_audiences, minlength=n_audiences)
+        starts = np.cumsum(per_audience) - per_audience
+        repeats = np.zeros(len(df), dtype=np.int64)
+        has_audience = audience_codes >= 0
+        repeats[has_audience] = per_audience[audience_codes[has_audience]]
+        rows = np.repeat(np.arange(len(df)), repeats)
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        row_segments = member_segments[starts[audience_codes[rows]] + offsets]
+
+    if not len(segments):
+        # Nothing to break down by: no interactions on the segmenting slide, or a type without segments
+        return {'slides': pd.DataFrame(columns=SEGMENT_STATS_COLUMNS), 'total_audience': n_audiences}
+
+    n_segments = len(segments)
+    cells = slide_codes[rows].astype(np.int64) * n_segments + row_segments
+    interaction_counts = np.bincount(cells, minlength=n_slides * n_segments)
+
+    # Distinct (cell, audience) keys, for the unique audience counts
+    row_audiences = audience_codes[rows]
+    has_audience = row_audiences >= 0
+    pairs = np.unique(cells[has_audience] * max(n_audiences, 1) + row_audiences[has_audience])
+    audience_counts = np.bincount(pairs // max(n_audiences, 1), minlength=n_slides * n_segments)
+
+    filled = np.flatnonzero(interaction_counts)
+    stats = pd.DataFrame({
+        'Slideid': np.asarray(slide_ids)[filled // n_segments],
+        'Segment': np.asarray(segments)[filled % n_segments],
+        'Interaction Count': interaction_counts[filled],
+        'Audience Count': audience_counts[filled],
+        'Segment Audience Count': segment_audiences[filled % n_segments],
+    })
+
+    slides = df.groupby('Slideid', sort=False, observed=True)[['Slidetitle', 'Slidetypenormalized', 'Slideorder']].first()
+    stats = stats.merge(slides, left_on='Slideid', right_index=True, how='left').sort_values(by='Slideorder')
+    stats = stats[SEGMENT_STATS_COLUMNS].reset_index(drop=True)
+    return {'slides': stats, 'total_audience': n_audiences}
+
+
+def build_poll_crosstab(df: pd.DataFrame):
+    """
+    Audience counts for every pair of poll answers of a presentation, in one pass.
+
+    Every (poll slide, answer) is a column, where an interaction without a decoded answer counts as
+    'No Category'. counts[i, j] is the number of audiences who gave both answer i and answer j,
+    bincounted over the answer pairs within each audience's own answer list, so memory follows the
+    answers given rather than audiences x answers. Interactions without an audienceid are skipped.
+
+    Args:
+        df: Decoded poll interactions, e.g. get_polls_of_presentation(...)
+
+    Returns:
+        Dict with 'options' (one row per column: 'Slideid', 'Slidetitle', 'Slideorder', 'Answer')
+        and the square 'counts' matrix
+    """
+    polls = df[(df['Slidetypenormalized'] == 'Poll') & df['audienceid'].notna()]
+    audience_codes, _ = pd.factorize(polls['audienceid'])
+    polls = pd.DataFrame({
+        'Slideid': polls['Slideid'].to_numpy(),
+        'Slidetitle': polls['Slidetitle'].astype(object).to_numpy(),
+        'Slideorder': polls['Slideorder'].to_numpy(),
+        'Answer': polls['Chosen Poll'].astype(object).fillna('No Category').to_numpy(),
+    })
+    option_codes = polls.groupby(['Slideorder', 'Slideid', 'Answer'], sort=True).ngroup().to_numpy()
+    options = polls.groupby(['Slideorder', 'Slideid', 'Answer'], sort=True, as_index=False)['Slidetitle'].first()
+
+    n_options = len(options)
+    # Distinct (audience, answer) pairs, sorted by audience
+    pairs = np.unique(audience_codes.astype(np.int64) * n_options + option_codes)
+    audience_of_pair, answer_of_pair = np.divmod(pairs, n_options)
+    starts = np.flatnonzero(np.r_[True, audience_of_pair[1:] != audience_of_pair[:-1]])
+    sizes = np.diff(np.r_[starts, len(pairs)])
+
+    # Each answer of an audience is paired with every answer of the same audience, itself included
+    size_of_pair = np.repeat(sizes, sizes)
+    first = np.repeat(np.arange(len(pairs)), size_of_pair)
+    block_starts = np.repeat(np.cumsum(size_of_pair) - size_of_pair, size_of_pair)
+    second = np.repeat(np.repeat(starts, sizes), size_of_pair) + np.arange(len(first)) - block_starts
+    counts = np.bincount(answer_of_pair[first] * n_options + answer_of_pair[second], minlength=n_options * n_options)
+    return {'options': options[['Slideid', 'Slidetitle', 'Slideorder', 'Answer']], 'counts': counts.reshape(n_options, n_options)}
+
+
+def poll_crosstab_pair(crosstab, first_slide_id, second_slide_id):
+    """
+    Contingency table of two poll slides from build_poll_crosstab: audiences per answer of the first
+    slide ('Chosen Poll') and of the second slide ('Category'). Only non-zero cells are returned.
+    """
+    options = crosstab['options']
+    rows = np.flatnonzero((options['Slideid'] == first_slide_id) & (options['Answer'] != 'No Category'))
+    cols = np.flatnonzero(options['Slideid'] == second_slide_id)
+    block = crosstab['counts'][np.ix_(rows, cols)]
+    pair = pd.DataFrame({
+        'Slidetitle': np.repeat(options['Slidetitle'].to_numpy()[rows], len(cols)),
+        'Chosen Poll': np.repeat(options['Answer'].to_numpy()[rows], len(cols)),
+        'Category': np.tile(options['Answer'].to_numpy()[cols], len(rows)),
+        'Audience Count': block.ravel(),
+    })
+    return pair[pair['Audience Count'] > 0].reset_index(drop=True)
+
+
+# SQL pushdown for the Deep Dive aggregations. The segment key of an audience is derived from
+# their interactions on the segmenting slide, depending on its type.
+SEGMENT_KEY_EXPRESSIONS = {
+    'All': "'All'",
+    'Poll': 'poll_vote',
+    'Open Ended': '"Title"',
+    'Pick Answer': "CASE WHEN correct = 'correct' THEN 'correct' ELSE 'incorrect' END",
+}
+
+_PUSHDOWN_CTES = """
+    WITH interactions AS (
+        SELECT "Slideid", "Slidetitle", "Slidetypenormalized", "Slideorder", audienceid, poll_vote, "Title", correct
+        FROM aha_report_x.mart_presentation_interactions
+        WHERE presentationid = :presentation_id
+        AND createdat >= dateadd(day, -90, getdate())
+    ),
+    segments AS (
+        SELECT DISTINCT audienceid, CAST({segment_key} AS VARCHAR(65535)) AS segment_key
+        FROM interactions
+        WHERE {segment_filter}
+    )
+"""
+
+# Segment keys are labeled in Python (see _segment_labels) and staged in this temp table, so that
+# audiences are counted once per label even when several raw keys share it
+SEGMENT_LABELS_TABLE = ('segment_labels', 'segment_key VARCHAR(65535), segment VARCHAR(65535)')
+
+_LABELED_SEGMENTS_CTE = """,
+    labeled_segments AS (
+        SELECT DISTINCT s.audienceid, COALESCE(l.segment, 'No Category') AS segment
+        FROM segments s LEFT JOIN segment_labels l ON s.segment_key = l.segment_key
+    )
+"""
+
+
+def _pushdown_ctes(slide_type: str):
+    return _PUSHDOWN_CTES.format(
+        segment_key=SEGMENT_KEY_EXPRESSIONS[slide_type],
+        segment_filter='TRUE' if slide_type == 'All' else '"Slideid" = :segment_slide_id'
+    )
+
+
+SEGMENT_KEYS = {
+    slide_type: register_query(f'segment_keys_{slide_type.lower().replace(" ", "_")}', _pushdown_ctes(slide_type) + """
+    SELECT DISTINCT segment_key FROM segments
+    """)
+    for slide_type in SEGMENT_KEY_EXPRESSIONS
+}
+
+SLIDE_SEGMENT_STATS = {
+    slide_type: register_query(f'slide_segment_stats_{slide_type.lower().replace(" ", "_")}', _pushdown_ctes(slide_type) + _LABELED_SEGMENTS_CTE + """
+    SELECT 'slide' AS kind, i."Slideid", i."Slidetitle", i."Slidetypenormalized", i."Slideorder", s.segment,
+        COUNT(*) AS interaction_count, COUNT(DISTINCT i.audienceid) AS audience_count
+    FROM interactions i JOIN labeled_segments s ON i.audienceid = s.audienceid
+    GROUP BY i."Slideid", i."Slidetitle", i."Slidetypenormalized", i."Slideorder", s.segment
+    UNION ALL
+    SELECT 'segment', NULL, NULL, NULL, NULL, s.segment, COUNT(*), COUNT(DISTINCT i.audienceid)
+    FROM interactions i JOIN labeled_segments s ON i.audienceid = s.audienceid
+    GROUP BY s.segment
+    UNION ALL
+    SELECT 'total', NULL, NULL, NULL, NULL, NULL, COUNT(*), COUNT(DISTINCT audienceid)
+    FROM interactions
+    """)
+    for slide_type in SEGMENT_KEY_EXPRESSIONS
+}
+
+AUDIENCE_SEGMENTS = {
+    slide_type: register_query(f'audience_segments_{slide_type.lower().replace(" ", "_")}', _pushdown_ctes(slide_type) + """
+    SELECT audienceid, segment_key FROM segments
+    """)
+    for slide_type in SEGMENT_KEY_EXPRESSIONS if slide_type != 'All'
+}
+
+SEGMENT_SLIDE = register_query('segment_slide', """
+    SELECT MAX("Slidetitle")
+    FROM aha_report_x.mart_presentation_interactions
+    WHERE presentationid = :presentation_id
+    AND "Slideid" = :segment_slide_id
+    AND createdat >= dateadd(day, -90, getdate())
+""")
+
+
+def _segment_slide_type(selected_slide):
+    return 'All' if selected_slide['Slideid'] == 'All' else selected_slide['Slidetypenormalized']
+
+
+def _segment_params(presentation_id, selected_slide):
+    params = {'presentation_id': int(presentation_id)}
+    if selected_slide['Slideid'] != 'All':
+        params['segment_slide_id'] = int(selected_slide['Slideid'])
+    return params
+
+
+def _segment_labels(presentation_id, selected_slide, segment_keys: pd.Series):
+    """
+    Same segment labels as get_audience_segment, computed for the (few) distinct segment keys.
+    """
+    slide_type = _segment_slide_type(selected_slide)
+    if slide_type == 'All':
+        return pd.Series('All', index=segment_keys.index)
+
+    slide = execute_frame(SEGMENT_SLIDE, _segment_params(presentation_id, selected_slide), columns=['Slidetitle'])
+    slide_title = slide['Slidetitle'].iloc[0]
+    if slide_type == 'Poll':
+        options = get_slide_option_table(presentation_id)
+        option_titles = options[options['Slideid'] == int(selected_slide['Slideid'])].set_index('option_id')['option_title']
+
+    def label(key):
+        if slide_type == 'Poll':
+            option_title = option_titles.get(pd.to_numeric(key, errors='coerce'))
+            return None if option_title is None else f'Answered: `{option_title}` for "{slide_title}"'
+        if slide_type == 'Open Ended':
+            return extract_short_answer(slide_title, key)
+        if key == 'correct':
+            return f'Answered Correctly to `{slide_title}`'
+        return f'Answered Incorrectly to `{slide_title}`'
+
+    labels = {key: label(key) for key in segment_keys.drop_duplicates()}
+    return segment_keys.map(labels).fillna('No Category')
+
+
+def _segment_label_rows(presentation_id, selected_slide):
+    """
+    (segment key, label) rows for the segment_labels temp table. Keys without a label are left out
+    and fall into 'No Category' in SQL.
+    """
+    slide_type = _segment_slide_type(selected_slide)
+    keys = execute_frame(SEGMENT_KEYS[slide_type], _segment_params(presentation_id, selected_slide), columns=['Segment Key'])
+    keys = keys['Segment Key'].dropna()
+    labels = _segment_labels(presentation_id, selected_slide, keys)
+    return sorted((key, label) for key, label in zip(keys, labels) if label != 'No Category')
+
+
+def get_slide_segment_stats(presentation_id: str, selected_slide):
+    """
+    Per slide x segment interaction and unique audience counts, aggregated in Redshift.
+
+    Args:
+        presentation_id: The presentation to aggregate
+        selected_slide: Slide dict used for the breakdown, or {'Slideid': 'All'}
+
+    Returns:
+        Dict with
+            'slides': DataFrame with 'Slideid', 'Slidetitle', 'Slidetypenormalized', 'Slideorder', 'Segment',
+                      'Interaction Count', 'Audience Count', 'Segment Audience Count'
+            'total_audience': number of unique audiences of the presentation
+    """
+    slide_type = _segment_slide_type(selected_slide)
+    # Keys are mapped to labels before COUNT(DISTINCT), distinct counts of keys sharing a label don't add up
+    df = execute_staged_frame(SLIDE_SEGMENT_STATS[slide_type], _segment_params(presentation_id, selected_slide),
+                              columns=['Kind', 'Slideid', 'Slidetitle', 'Slidetypenormalized', 'Slideorder', 'Segment',
+                                       'Interaction Count', 'Audience Count'],
+                              staged_tables={SEGMENT_LABELS_TABLE[0]: (SEGMENT_LABELS_TABLE[1], _segment_label_rows(presentation_id, selected_slide))})
+
+    segments = df[df['Kind'] == 'segment'].set_index('Segment')['Audience Count'].rename('Segment Audience Count')
+    slides = df[df['Kind'] == 'slide'].drop(columns=['Kind']).copy()
+    slides['Slideid'] = slides['Slideid'].astype('int64')
+    slides['Slidetitle'] = slides['Slidetitle'].fillna('(empty)').astype(str)
+    slides = slides.merge(segments, left_on='Segment', right_index=True, how='left').sort_values(by='Slideorder').reset_index(drop=True)
+
+    total = df.loc[df['Kind'] == 'total', 'Audience Count']
+    return {'slides': slides, 'total_audience': int(total.iloc[0]) if len(total) else 0}
+
+
+def get_audience_segments(presentation_id: str, selected_slide):
+    """
+    audienceid -> 'Segment' for the selected slide, computed in Redshift.
+    """
+    slide_type = _segment_slide_type(selected_slide)
+    if slide_type == 'All':
+        return None
+    df = execute_frame(AUDIENCE_SEGMENTS[slide_type], _segment_params(presentation_id, selected_slide),
+                       columns=['audienceid', 'Segment Key'])
+    df['Segment'] = _segment_labels(presentation_id, selected_slide, df['Segment Key'])
+    # Keys sharing a label (e.g. NULL and an unknown option -> 'No Category') must not repeat an audience
+    return df[['audienceid', 'Segment']].drop_duplicates().reset_index(drop=True)
+
+
+QUESTION_SUMMARY = register_query('question_summary', """
+    WITH per_question AS (
     SELECT
     dp.name as presentation_title,
     ds.title AS slide_title,
-    AVG(f.earned_points) AS avg_point
+    AVG(f.earned_points) AS avg_point,
+    COUNT(DISTINCT CASE WHEN f.earned_points = 0 THEN f.audienceid END) AS wrong_count
         FROM aha_report_x.fct_points f
         JOIN aha_report_x.dim_presentations dp
             ON f.presentationid = dp.id
         JOIN aha_report_x.dim_slides ds
             ON f.slideid = ds.id
-        WHERE dp.userid = {user_id}
+        WHERE dp.userid = :user_id
         AND f.createdat >= dateadd(day, -60, getdate())
         GROUP BY ds.title, dp.name
-        ORDER BY avg_point ASC
-        LIMIT 1000;
+    ),
+    ranked AS (
+    SELECT *,
+        ROW_NUMBER() OVER (ORDER BY avg_point ASC) AS avg_rank,
+        CASE WHEN wrong_count > 0 THEN ROW_NUMBER() OVER (ORDER BY wrong_count DESC) END AS wrong_rank
+    FROM per_question
+    )
+    -- Only the rows of the two top 1000 lists leave Redshift
+    SELECT presentation_title, slide_title, avg_point, wrong_count, avg_rank, wrong_rank
+    FROM ranked
+    WHERE avg_rank <= 1000 OR wrong_rank <= 1000;
+""")
+
+
+def get_question_summary(user_id: int):
+    """
+    Per question aggregates of the last 60 days, computed in a single scan of fct_points.
+
+    Returns:
+        Dict with the 'avg_point_per_question' and 'wrong_often_questions' DataFrames
     """
-    rows = execute(sql)
-    df = pd.DataFrame(rows, columns=['Presentation', 'Question', 'Avg Point'])
+    df = execute_frame(QUESTION_SUMMARY, {'user_id': int(user_id)},
+                       columns=['Presentation', 'Question', 'Avg Point', 'Wrong Count', 'Avg Rank', 'Wrong Rank'])
     df['Avg Point'] = df['Avg Point'].astype(float)
-    return df
+
+    avg_df = df[df['Avg Rank'] <= 1000].sort_values('Avg Rank')[['Presentation', 'Question', 'Avg Point']].reset_index(drop=True)
+
+    wrong_df = df[df['Wrong Rank'] <= 1000].sort_values('Wrong Rank')
+    wrong_df = wrong_df[['Presentation', 'Question', 'Wrong Count']].rename(columns={'Wrong Count': 'No participant who got this wrong'}).reset_index(drop=True)
+
+    return {'avg_point_per_question': avg_df, 'wrong_often_questions': wrong_df}
+
+
+def get_avg_point_per_question(user_id: int):
+    return get_question_summary(user_id)['avg_point_per_question']
 
 
 def get_wrong_often_questions(user_id: int):
-    sql = f"""
+    return get_question_summary(user_id)['wrong_often_questions']
+
+
+PARTICIPANT_STATS_BY_SLIDE_CATEGORY = register_query('participant_stats_by_slide_category', """
     SELECT
-    dp.name as presentation_title,
-    ds.title AS slide_title,
-    COUNT(DISTINCT f.audienceid) AS avg_point
-        FROM aha_report_x.fct_points f
-        JOIN aha_report_x.dim_presentations dp
-            ON f.presentationid = dp.id
-        JOIN aha_report_x.dim_slides ds
-            ON f.slideid = ds.id
-        WHERE dp.userid = {user_id}
-        AND f.earned_points = 0
-        AND f.createdat >= dateadd(day, -60, getdate())
-        GROUP BY ds.title, dp.name
-        ORDER BY avg_point DESC
-        LIMIT 1000;
-    """
-    rows = execute(sql)
-    return pd.DataFrame(rows, columns=['Presentation', 'Question', 'No participant who got this wrong'])
+        mp.audience_name,
+        sc.category,
+        AVG(mp.earned_points::double precision) AS avg_point,
+        COUNT(mp.id) AS answer_count
+    FROM aha_report_x.mart_points mp
+    JOIN slide_categories sc
+        ON mp.slideid = sc.slideid
+    WHERE mp.userid = :user_id
+    AND mp.audience_name IS NOT NULL
+    GROUP BY mp.audience_name, sc.category
+    HAVING COUNT(mp.id) > 10
+""")
 
 
 def get_participant_stats_with_slide_ids(user_id: int, slide_df: pd.DataFrame):
@@ -292,43 +1150,20 @@ def get_participant_stats_with_slide_ids(user_id: int, slide_df: pd.DataFrame):
     Returns:
         DataFrame with participant stats grouped by slide category
     """
-    # For large datasets, use a simpler approach: filter first, then group in pandas
-    # This avoids complex SQL escaping issues with special characters
+    # The slide -> category mapping is staged once in a session temp table and joined server side,
+    # so the SQL text stays small and only the aggregated rows come back over the wire
+    mapping = slide_df[['id', 'category']].assign(id=pd.to_numeric(slide_df['id'], errors='coerce'))
+    # Ids that are not numbers cannot match a slide, they are left out of the staged table
+    mapping = mapping.dropna().drop_duplicates('id', keep='last')
+    rows = sorted(zip(mapping['id'].astype('int64').tolist(), mapping['category'].astype(str)))
 
-    # Get the slide IDs as a comma-separated string for SQL
-    slide_id_list = "'" + "','".join(slide_df['id'].astype(str)) + "'"
-
-    sql = f"""
-    SELECT
-        mp.audience_name,
-        mp.slideid,
-        mp.earned_points,
-        mp.id
-    FROM aha_report_x.mart_points mp
-    WHERE mp.userid = {user_id}
-    AND mp.slideid IN ({slide_id_list})
-    """
-
-    rows = execute(sql)
-    df = pd.DataFrame(rows, columns=['Participant Name', 'Slide ID', 'Earned Points', 'Answer ID'])
-
-    # Create mapping dictionary for slide ID -> category
-    slide_category_map = dict(zip(slide_df['id'].astype(str), slide_df['category']))
-
-    # Map slide IDs to categories
-    df['Category'] = df['Slide ID'].astype(str).map(slide_category_map)
-
-    # Group by participant and category, then aggregate
-    result_df = df.groupby(['Participant Name', 'Category']).agg({
-        'Earned Points': 'mean',
-        'Answer ID': 'count'
-    }).reset_index()
-
-    # Rename columns to match expected output
-    result_df.columns = ['Participant Name', 'Category', 'Avg Point', 'Answer Count']
+    result_df = execute_staged_frame(
+        PARTICIPANT_STATS_BY_SLIDE_CATEGORY, {'user_id': int(user_id)},
+        columns=['Participant Name', 'Category', 'Avg Point', 'Answer Count'],
+        staged_tables={'slide_categories': ('slideid BIGINT, category VARCHAR(1024)', rows)}
+    )
 
-    # Filter participants with more than 10 answers and clean up data types
-    result_df = result_df[result_df['Answer Count'] > 10].copy()
+    # Clean up data types
     result_df['Avg Point'] = result_df['Avg Point'].astype(float).fillna(0)
     result_df['Answer Count'] = result_df['Answer Count'].astype(int)
 
@@ -338,43 +1173,109 @@ def get_participant_stats_with_slide_ids(user_id: int, slide_df: pd.DataFrame):
     return result_df
 
 
-def get_participant_stats(user_id: int):
-    sql = f"""
+PARTICIPANT_SUMMARY = register_query('participant_summary', """
     with answer_stats as (
-    select audience_name, AVG(earned_points) as avg_point, COUNT(id) as answer_count from aha_report_x.mart_points
-    where userid = {user_id}
+    select audience_name,
+        AVG(earned_points)::double precision as avg_point,
+        COUNT(id) as answer_count,
+        ROW_NUMBER() OVER (ORDER BY AVG(earned_points) ASC) as part_rank
+    from aha_report_x.mart_points
+    where userid = :user_id
+    group by audience_name
+    having COUNT(id) > 10
+    ),
+    correct_stats as (
+    select audience_name,
+        COUNT(id) as answer_count,
+        SUM(CASE WHEN correct = 'correct' THEN 1 ELSE 0 END) as correct_count,
+        SUM(CASE WHEN correct = 'incorrect' THEN 1 ELSE 0 END) as incorrect_count,
+        ROW_NUMBER() OVER (ORDER BY 1.0 * SUM(CASE WHEN correct = 'correct' THEN 1 ELSE 0 END) / COUNT(*) ASC) as part_rank
+    from aha_report_x.mart_presentation_interactions
+    where userid = :user_id and correct IN ('correct', 'incorrect')
     group by audience_name
-    order by avg_point ASC
+    having COUNT(id) > 10
     )
-    select * from answer_stats where answer_count > 10 LIMIT 1000
+    -- Each part is ranked and limited to 1000 rows in Redshift
+    select 'points' as part, audience_name, avg_point, answer_count,
+        NULL::bigint as correct_count, NULL::bigint as incorrect_count, part_rank
+    from answer_stats where part_rank <= 1000
+    union all
+    select 'correct' as part, audience_name, NULL::double precision as avg_point, answer_count,
+        correct_count, incorrect_count, part_rank
+    from correct_stats where part_rank <= 1000
+""")
+
+
+def get_participant_summary(user_id: int):
     """
-    rows = execute(sql)
-    df = pd.DataFrame(rows, columns=['Participant Name', 'Avg Point', 'Answer Count' ])
-    df['Avg Point'] = df['Avg Point'].astype(float)
-    df['Avg Point'] = df['Avg Point'].fillna(0)
-    return df
+    Per participant score and correctness stats, fetched in one round trip
+    (one scan of mart_points and one of mart_presentation_interactions).
+
+    Returns:
+        Dict with the 'participant_stats' and 'participant_correct_stats' DataFrames
+    """
+    df = execute_frame(PARTICIPANT_SUMMARY, {'user_id': int(user_id)},
+                       columns=['Part', 'Participant Name', 'Avg Point', 'Answer Count', 'Correct Answers', 'Incorrect Answers', 'Rank'])
+    df = df.sort_values('Rank')
+
+    stats_df = df[df['Part'] == 'points']
+    stats_df = stats_df[['Participant Name', 'Avg Point', 'Answer Count']].reset_index(drop=True)
+    stats_df['Avg Point'] = stats_df['Avg Point'].astype(float)
+    stats_df['Avg Point'] = stats_df['Avg Point'].fillna(0)
+    stats_df['Answer Count'] = stats_df['Answer Count'].astype(int)
+
+    correct_df = df[df['Part'] == 'correct'].rename(columns={'Answer Count': 'Total Answers'})
+    correct_df = correct_df[['Participant Name', 'Correct Answers', 'Incorrect Answers', 'Total Answers']].astype(
+        {'Correct Answers': int, 'Incorrect Answers': int, 'Total Answers': int})
+    correct_df['Correct Ratio'] = (correct_df['Correct Answers'] / correct_df['Total Answers']).round(4)
+    correct_df = correct_df.reset_index(drop=True)
+    correct_df['Correct Percentage'] = correct_df['Correct Ratio'] * 100
+    correct_df['Correct Percentage'] = correct_df['Correct Percentage'].round(2)
+
+    return {'participant_stats': stats_df, 'participant_correct_stats': correct_df}
+
+
+def get_participant_stats(user_id: int):
+    return get_participant_summary(user_id)['participant_stats']
 
 
 def get_participant_correct_stats(user_id: int):
-    sql = f"""
-    with correct_stats as (
-	select audience_name,
-		SUM(CASE WHEN correct = 'correct' THEN 1 ELSE 0 END) AS correct_count,
-	    SUM(CASE WHEN correct = 'incorrect' THEN 1 ELSE 0 END) AS incorrect_count,
-	    COUNT(id) AS total_answers,
-	    1.0 * SUM(CASE WHEN correct = 'correct' THEN 1 ELSE 0 END) / COUNT(*) AS correct_ratio
-	from aha_report_x.mart_presentation_interactions
-	where userid = {user_id} and correct IN ('correct', 'incorrect')
-	group by audience_name
-    )
-    select * from correct_stats
-    where total_answers > 10
-    order by correct_ratio ASC
-    LIMIT 1000
-    """
-    rows = execute(sql)
-    df = pd.DataFrame(rows, columns=['Participant Name', 'Correct Answers', 'Incorrect Answers', 'Total Answers', 'Correct Ratio'])
-    df['Correct Ratio'] = df['Correct Ratio'].astype(float).round(4)
-    df['Correct Percentage'] = df['Correct Ratio'] * 100
-    df['Correct Percentage'] = df['Correct Percentage'].round(2)
-    return df
\ No newline at end of file
+    return get_participant_summary(user_id)['participant_correct_stats']
+
+
+# Independent queries of one render run concurrently; shared by all sessions, so sized to
+# every connection the pool can hand out (overflow included) rather than one render's worth
+_batch_executor = ThreadPoolExecutor(max_workers=REDSHIFT_POOL_SIZE + REDSHIFT_MAX_OVERFLOW, thread_name_prefix='warehouse')
+
+
+def submit_batch(calls: Dict[str, Tuple[Callable, dict]]):
+    """
+    Submit independent warehouse queries to a shared thread pool.
+
+    Args:
+        calls: Mapping of result name -> (warehouse function, keyword arguments)
+
+    Returns:
+        Dict of result name -> Future
+    """
+    # Workers run under the caller's ScriptRunContext, so cached loaders in them behave as in the script thread
+    ctx = get_script_run_ctx(suppress_warning=True)
+
+    def run(fn, kwargs):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(**kwargs)
+
+    return {name: _batch_executor.submit(run, fn, kwargs) for name, (fn, kwargs) in calls.items()}
+
+
+def fetch_batch(calls: Dict[str, Tuple[Callable, dict]]):
+    """
+    Run independent warehouse queries concurrently and wait for all of them,
+    so the latency is the slowest query instead of the sum.
+
+    Returns:
+        Dict of result name -> DataFrame
+    """
+    futures = submit_batch(calls)
+    return {name: future.result() for name, future in futures.items()}